@@ -0,0 +1,297 @@
+# coding=utf8
+import asyncio
+import functools
+import json
+import os
+import aiohttp
+from .errors import *
+from .converter import convert_json_to_html
+from .html_to_telegraph import api_url, base_url, default_user_agent, save_url
+from .html_to_telegraph import _prepare_upload, _upload_result, _prepare_api_upload, _api_result
+from .html_to_telegraph import _api_upload_params, _api_upload_request, _page_digest
+
+
+def create_async_session(pool_size=10, timeout=30):
+    """
+        Creates aiohttp session with keep-alive connection pool. Must be called inside the running event loop
+    :param pool_size: max number of simultaneously open connections
+    :param timeout: total timeout of a request in seconds
+    :return: aiohttp.ClientSession object
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=pool_size),
+        timeout=aiohttp.ClientTimeout(total=timeout)
+    )
+
+
+def _query_params(params):
+    # aiohttp accepts only strings and numbers in query
+    return dict(
+        (k, str(v).lower() if isinstance(v, bool) else v) for k, v in params.items() if v is not None
+    )
+
+
+class AsyncTelegraphPoster(object):
+    """
+        asyncio version of TelegraphPoster. All api methods are coroutines, html conversion runs in executor.
+    """
+    def __init__(self, tph_uuid=None, page_id=None, user_agent=default_user_agent, clean_html=True, convert_html=True,
+                 use_api=False, access_token=None, telegraph_api_url=api_url, telegraph_base_url=base_url,
+                 conversion_cache=None, session=None, pool_size=10, executor=None, rate_limiter=None,
+                 skip_unchanged=False):
+        """
+        :param session: aiohttp.ClientSession used for all requests, see create_async_session().
+            If not passed, the session is created on first request and closed in close()
+        :param pool_size: max number of open connections of the created session
+        :param executor: concurrent.futures executor for html conversion, default executor of the loop if not set
+        :param rate_limiter: RateLimiter shared with other posters, requests wait for it and are repeated
+            after FLOOD_WAIT errors
+        :param skip_unchanged: same as for TelegraphPoster
+        """
+        self.title = None
+        self.author = None
+        self.author_url = None
+        self.text = None
+        self.path = None
+        self.tph_uuid = tph_uuid
+        self.page_id = page_id
+        self.user_agent = user_agent
+        self.clean_html = clean_html
+        self.convert_html = convert_html
+        self.access_token = access_token or os.getenv('TELEGRAPH_ACCESS_TOKEN', None)
+        self.account = None
+        self.use_api = use_api
+        self.telegraph_api_url = telegraph_api_url
+        self.telegraph_base_url = telegraph_base_url
+        self.conversion_cache = conversion_cache
+        self.pool_size = pool_size
+        self.executor = executor
+        self._own_session = session is None
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.skip_unchanged = skip_unchanged
+        self.published = {}
+        self.skipped_edits = 0
+        if self.access_token:
+            # use api anyway
+            self.use_api = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        """
+            Closes connections of the session created by AsyncTelegraphPoster
+        """
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _get_session(self):
+        if self.session is None:
+            self.session = create_async_session(self.pool_size)
+        return self.session
+
+    def _run_in_executor(self, func, *args):
+        return asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def _send_limited(self, key, endpoint, func, *args):
+        if self.rate_limiter is None:
+            return await func(*args)
+        return await self.rate_limiter.call_async(key, endpoint, func, *args)
+
+    async def _api_request(self, method, params=None):
+        params = params or {}
+        if self.access_token:
+            params['access_token'] = self.access_token
+        return await self._send_limited(self.access_token, method, self._send_api_request, method, params)
+
+    async def _send_api_request(self, method, params):
+        async with self._get_session().get(self.telegraph_api_url + '/' + method, params=_query_params(params),
+                                           headers={'User-Agent': self.user_agent}) as resp:
+            json_response = await resp.json(content_type=None)
+        if self.rate_limiter is not None and 'FLOOD_WAIT_' in json_response.get('error', ''):
+            # let rate limiter repeat the request
+            raise TelegraphError(json_response['error'])
+        return json_response
+
+    async def post(self, title, author, text, author_url=''):
+        self.path = None
+        self.title = title
+        self.author = author
+        self.author_url = author_url
+        self.text = text
+        result = await self.edit()
+        if not self.use_api:
+            self.tph_uuid = result['tph_uuid']
+            self.page_id = result['page_id']
+        return result
+
+    async def edit(self, title=None, author=None, text=None, author_url='', path=None):
+        title = title or self.title
+        author = author or self.author
+        text = text or self.text
+        author_url = author_url or self.author_url
+        if self.use_api:
+            path = path or self.path
+            digest = None
+            if self.skip_unchanged:
+                page = await self._run_in_executor(
+                    _api_upload_params, title, author, text, author_url, self.access_token, self.convert_html,
+                    self.clean_html, path, self.conversion_cache
+                )
+                digest = await self._run_in_executor(_page_digest, page)
+                if path and path in self.published and self.published[path][0] == digest:
+                    self.skipped_edits += 1
+                    self.path = path
+                    return dict(self.published[path][1])
+                url, data, headers = await self._run_in_executor(
+                    _api_upload_request, page, self.user_agent, self.telegraph_api_url
+                )
+            else:
+                url, data, headers = await self._run_in_executor(
+                    _prepare_api_upload, title, author, text, author_url, self.access_token, self.user_agent,
+                    self.convert_html, self.clean_html, path, self.telegraph_api_url, self.conversion_cache
+                )
+
+            async def send():
+                async with self._get_session().post(url, data=data, headers=headers) as resp:
+                    return _api_result(await resp.json(content_type=None))
+
+            result = await self._send_limited(self.access_token, 'editPage' if path else 'createPage', send)
+            self.path = result['path']
+            if digest is not None:
+                self.published[result['path']] = (digest, dict(result))
+            return result
+        else:
+            tph_uuid = self.tph_uuid
+            headers, cookies, data = await self._run_in_executor(
+                _prepare_upload, title, author, text, author_url, tph_uuid, self.page_id, self.user_agent,
+                self.convert_html, self.clean_html, self.telegraph_base_url, self.conversion_cache
+            )
+
+            async def send():
+                async with self._get_session().post(save_url, headers=headers, cookies=cookies, data=data) as resp:
+                    result = json.loads(await resp.text())
+                    new_tph_uuid = resp.cookies.get('tph_uuid')
+                return _upload_result(result, new_tph_uuid.value if new_tph_uuid else tph_uuid, self.telegraph_base_url)
+
+            return await self._send_limited(tph_uuid, 'save', send)
+
+    async def get_account_info(self, fields=None):
+        """
+            Same as TelegraphPoster.get_account_info()
+        """
+        if not self.access_token:
+            raise Exception('Access token is required')
+
+        json_response = await self._api_request('getAccountInfo', {
+            'fields': json.dumps(fields) if fields else ''
+        })
+        return json_response.get('result')
+
+    async def edit_account_info(self, short_name, author_name='', author_url=''):
+        """
+            Same as TelegraphPoster.edit_account_info()
+        """
+        if not self.access_token:
+            raise Exception('Access token is required')
+        params = {
+            'short_name': short_name
+        }
+        if author_name:
+            params['author_name'] = author_name
+        if author_url:
+            params['author_url'] = author_url
+        json_response = await self._api_request('editAccountInfo', params)
+        return json_response.get('result')
+
+    async def get_page(self, path, return_content=False):
+        """
+            Same as TelegraphPoster.get_page()
+        """
+        json_response = await self._api_request('getPage', {
+            'path': path,
+            'return_content': return_content
+        })
+        if return_content:
+            json_response['result']['html'] = await self._run_in_executor(
+                convert_json_to_html, json_response['result']['content'], self.telegraph_base_url
+            )
+        return json_response.get('result')
+
+    async def get_page_list(self, offset=0, limit=50):
+        """
+            Same as TelegraphPoster.get_page_list()
+        """
+        json_response = await self._api_request('getPageList', {
+            'offset': offset,
+            'limit': limit
+        })
+        return json_response.get('result')
+
+    async def get_views(self, path, year=None, month=None, day=None, hour=None):
+        """
+            Same as TelegraphPoster.get_views()
+        """
+        json_response = await self._api_request('getViews', {
+            'path': path,
+            'year': year,
+            'month': month,
+            'day': day,
+            'hour': hour
+        })
+        return json_response.get('result')
+
+    async def create_api_token(self, short_name, author_name=None, author_url=None):
+        """
+            Same as TelegraphPoster.create_api_token()
+        """
+        params = {
+            'short_name': short_name,
+        }
+        if author_name:
+            params.update({'author_name': author_name})
+        if author_url:
+            params.update({'author_url': author_url})
+        async with self._get_session().get(self.telegraph_api_url + '/createAccount', params=params,
+                                           headers={'User-Agent': self.user_agent}) as resp:
+            token_data = (await resp.json(content_type=None))['result']
+        self.use_api = True
+        self.account = token_data
+        self.access_token = token_data['access_token']
+        return token_data
+
+    async def revoke_access_token(self):
+        """
+            Same as TelegraphPoster.revoke_access_token()
+        """
+        if not self.access_token:
+            raise Exception('Access token is required')
+
+        json_response = await self._api_request('revokeAccessToken')
+        if json_response['ok'] is True:
+            self.access_token = json_response['result']['access_token']
+
+        return json_response['result']
+
+    async def create_page(self, *args, **kwargs):
+        """
+            Shortcut method for post()
+        """
+        return await self.post(*args, **kwargs)
+
+    async def edit_page(self, *args, **kwargs):
+        """
+            Shortcut method for edit()
+        """
+        return await self.edit(*args, **kwargs)
+
+    async def create_account(self, *args, **kwargs):
+        """
+            Shortcut method for create_api_token()
+        """
+        return await self.create_api_token(*args, **kwargs)
@@ -0,0 +1,176 @@
+# coding=utf8
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from .converter import convert_html_to_telegraph_format, OutputFormat
+
+
+class ConversionCache(object):
+    """
+        Caches results of convert_html_to_telegraph_format by hash of the html and conversion options.
+        Keeps last max_size results in memory, and all results in sqlite database if path is set.
+    """
+    def __init__(self, max_size=256, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS conversions (key TEXT PRIMARY KEY, content TEXT)')
+            self._db.commit()
+
+    @staticmethod
+    def make_key(html_string, clean_html=True, output_format=OutputFormat.JSON_STRING):
+        digest = hashlib.sha256(html_string.encode('utf-8', 'surrogatepass')).hexdigest()
+        return '%s:%d:%s' % (digest, bool(clean_html), output_format)
+
+    def get(self, key):
+        with self._lock:
+            content = self._items.get(key)
+            if content is not None:
+                self._items.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute('SELECT content FROM conversions WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    content = row[0]
+                    self._remember(key, content)
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return content
+
+    def set(self, key, content):
+        with self._lock:
+            self._remember(key, content)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO conversions (key, content) VALUES (?, ?)', (key, content))
+                self._db.commit()
+
+    def _remember(self, key, content):
+        self._items[key] = content
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def convert(self, html_string, clean_html=True, output_format=OutputFormat.JSON_STRING):
+        """
+            Same as convert_html_to_telegraph_format, but returns cached result for the same html and options
+        """
+        # python list is stored as json, so every caller gets its own copy
+        stored_format = OutputFormat.JSON_STRING if output_format == OutputFormat.PYTHON_LIST else output_format
+        key = self.make_key(html_string, clean_html, stored_format)
+        content = self.get(key)
+        if content is None:
+            content = convert_html_to_telegraph_format(html_string, clean_html, stored_format)
+            self.set(key, content)
+        return json.loads(content) if output_format == OutputFormat.PYTHON_LIST else content
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM conversions')
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class ImageUploadCache(object):
+    """
+        Remembers telegra.ph files of uploaded images by sha256 of the image and by source url with its
+        ETag/Last-Modified, so the same image is not uploaded again and unchanged urls are not downloaded again.
+        Stored in sqlite database. Entries not used for max_age seconds and the least recently used entries over
+        max_entries are removed.
+    """
+    def __init__(self, path, max_entries=10000, max_age=30 * 24 * 3600):
+        """
+        :param path: sqlite database file, the cache is kept between runs.
+            ':memory:' keeps it only until close()
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS image_files (sha256 TEXT PRIMARY KEY, src TEXT, used REAL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS image_urls '
+                         '(url TEXT PRIMARY KEY, sha256 TEXT, etag TEXT, last_modified TEXT, used REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS image_files_used ON image_files (used)')
+        self._db.commit()
+
+    def get_url(self, url):
+        """
+        :return: (src, etag, last_modified) of the image uploaded from url, or None
+        """
+        with self._lock:
+            return self._db.execute(
+                'SELECT f.src, u.etag, u.last_modified FROM image_urls u JOIN image_files f ON u.sha256 = f.sha256 '
+                'WHERE u.url = ? AND u.used > ?', (url, time.time() - self.max_age)
+            ).fetchone()
+
+    def get_file(self, sha256):
+        """
+        :return: telegra.ph src (/file/...) of the image with the same sha256, or None
+        """
+        with self._lock:
+            row = self._db.execute('SELECT src FROM image_files WHERE sha256 = ? AND used > ?',
+                                   (sha256, time.time() - self.max_age)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def set(self, sha256, src, url=None, etag=None, last_modified=None):
+        with self._lock:
+            now = time.time()
+            self._db.execute('INSERT OR REPLACE INTO image_files (sha256, src, used) VALUES (?, ?, ?)',
+                             (sha256, src, now))
+            if url is not None:
+                self._db.execute('INSERT OR REPLACE INTO image_urls (url, sha256, etag, last_modified, used) '
+                                 'VALUES (?, ?, ?, ?, ?)', (url, sha256, etag, last_modified, now))
+            self._evict(now)
+            self._db.commit()
+
+    def touch_url(self, url):
+        """
+            Marks image uploaded from url as used, when the source is not modified
+        """
+        with self._lock:
+            now = time.time()
+            self.hits += 1
+            self._db.execute('UPDATE image_urls SET used = ? WHERE url = ?', (now, url))
+            self._db.execute('UPDATE image_files SET used = ? WHERE sha256 = '
+                             '(SELECT sha256 FROM image_urls WHERE url = ?)', (now, url))
+            self._db.commit()
+
+    def _evict(self, now):
+        self._db.execute('DELETE FROM image_files WHERE used <= ?', (now - self.max_age,))
+        self._db.execute('DELETE FROM image_files WHERE sha256 IN '
+                         '(SELECT sha256 FROM image_files ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+        self._db.execute('DELETE FROM image_urls WHERE used <= ? OR sha256 NOT IN (SELECT sha256 FROM image_files)',
+                         (now - self.max_age,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM image_urls')
+            self._db.execute('DELETE FROM image_files')
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,15 +1,21 @@
 # encoding=utf8
+import concurrent.futures
 import json
+import os
 import re
 import sys
-from lxml import html
+from collections import deque, namedtuple
+from lxml import etree, html
 from lxml.html.clean import Cleaner
 
+from lxml.html.defs import link_attrs
+from .errors import TelegraphContentTooBigError
+
 if sys.version_info[0] == 2:
-    from urllib import quote_plus
-    from urlparse import urlparse
+    from urllib import quote, quote_plus
+    from urlparse import urlparse, urljoin
 else:
-    from urllib.parse import urlparse, quote_plus
+    from urllib.parse import urlparse, urljoin, quote, quote_plus
 
 allowed_tags = ('a', 'aside', 'b', 'blockquote', 'br', 'code', 'em', 'figcaption', 'figure', 'h3', 'h4', 'hr', 'i',
                 'iframe', 'img', 'li', 'ol', 'p', 'pre', 's', 'strong', 'u', 'ul', 'video')
@@ -21,11 +27,42 @@ youtube_re = re.compile(r'(https?:)?//(www\.)?youtube(-nocookie)?\.com/embed/')
 vimeo_re = re.compile(r'(https?:)?//player\.vimeo\.com/video/(\d+)')
 twitter_re = re.compile(r'(https?:)?//(www\.)?twitter\.com/[A-Za-z0-9_]{1,15}/status/\d+')
 telegram_embed_iframe_re = re.compile(r'^(https?)://(t\.me|telegram\.me|telegram\.dog)/([a-zA-Z0-9_]+)/(\d+)', re.IGNORECASE)
-telegram_embed_script_re = re.compile(r'''<script(?=[^>]+\sdata-telegram-post=['"]([^'"]+))[^<]+</script>''', re.IGNORECASE)
 pre_content_re = re.compile(r'<(pre|code)(>|\s[^>]*>)[\s\S]*?</\1>')
 line_breaks_inside_pre = re.compile(r'<br(/?>|\s[^<>]*>)')
 line_breaks_and_empty_strings = re.compile(r'(\s{2,}|\s*\r?\n\s*)')
-header_re = re.compile(r'<head[^a-z][\s\S]*</head>')
+# html serialization rules of lxml (libxml2), used when writing html directly
+void_tags = ('area', 'base', 'basefont', 'br', 'col', 'frame', 'hr', 'img', 'input', 'link', 'meta', 'param')
+no_end_tag_if_empty = ('isindex', 'li')
+uri_attributes = ('href', 'src', 'action')
+# only whitespace, control and non-ascii characters are escaped in url attributes
+uri_safe_characters = ''.join(chr(x) for x in range(0x21, 0x7f))
+# ancestors which are not split when figure or blockquote is moved out of them, copies would duplicate the media or link
+unsplittable_tags = ('a', 'iframe', 'video')
+# telegra.ph rejects pages with bigger content (compact utf-8 json of the nodes)
+max_content_size = 64 * 1024
+multiple_line_breaks_re = re.compile(r'(<br(/?>|\s[^<>]*>)\s*)+')
+# all rewrites made before Cleaner, in a single pass
+pre_clean_rewrite_re = re.compile(
+    # remove <head> if present (can't do this with Cleaner)
+    r'(?P<head><head[^a-z][\s\S]*</head>)|'
+    # convert telegram embed posts before cleaner
+    r'(?P<telegram_script>(?i:<script(?=[^>]+\sdata-telegram-post=[\'"](?P<telegram_post>[^\'"]+))[^<]+</script>))|'
+    r'(?P<h1_open><h1)|'
+    r'(?P<h1_close></h1>)|'
+    # telegram will convert <b> anyway
+    r'<(?P<strong>/?)b(?=\s|>)|'
+    r'<(?P<h4>/?)(?:h2|h5|h6)'
+)
+
+
+default_cleaner = Cleaner(
+    allow_tags=allowed_tags,
+    style=True,
+    remove_unknown_tags=False,
+    embedded=False,
+    safe_attrs_only=True,
+    safe_attrs=('src', 'href', 'class')
+)
 
 
 class OutputFormat:
@@ -34,62 +71,56 @@ class OutputFormat:
     PYTHON_LIST = 'python_list'
 
 
-def clean_article_html(html_string):
+def _pre_clean_rewrite(match):
+    kind = match.lastgroup
+    if kind == 'head':
+        return ''
+    elif kind == 'telegram_script':
+        return '<iframe src="https://t.me/%s"></iframe>' % match.group('telegram_post')
+    elif kind == 'h1_open':
+        return '<h3'
+    elif kind == 'h1_close':
+        return '</h3>'
+    elif kind == 'strong':
+        return '<%sstrong' % match.group('strong')
+    else:
+        return '<%sh4' % match.group('h4')
+
+
+def clean_article_html(html_string, cleaner=None):
+
+    html_string = pre_clean_rewrite_re.sub(_pre_clean_rewrite, html_string)
 
-    html_string = html_string.replace('<h1', '<h3').replace('</h1>', '</h3>')
-    # telegram will convert <b> anyway
-    html_string = re.sub(r'<(/?)b(?=\s|>)', r'<\1strong', html_string)
-    html_string = re.sub(r'<(/?)(h2|h5|h6)', r'<\1h4', html_string)
-    # convert telegram embed posts before cleaner
-    html_string = re.sub(telegram_embed_script_re, r'<iframe src="https://t.me/\1"></iframe>', html_string)
-    # remove <head> if present (can't do this with Cleaner)
-    html_string = header_re.sub('', html_string)
-
-    c = Cleaner(
-        allow_tags=allowed_tags,
-        style=True,
-        remove_unknown_tags=False,
-        embedded=False,
-        safe_attrs_only=True,
-        safe_attrs=('src', 'href', 'class')
-    )
     # wrap with div to be sure it is there
     # (otherwise lxml will add parent element in some cases
     html_string = '<div>%s</div>' % html_string
-    cleaned = c.clean_html(html_string)
+    cleaned = (cleaner or default_cleaner).clean_html(html_string)
     # remove wrapped div
     cleaned = cleaned[5:-6]
     # remove all line breaks and empty strings
     html_string = replace_line_breaks_except_pre(cleaned)
     # but replace multiple br tags with one line break, telegraph will convert it to <br class="inline">
-    html_string = re.sub(r'(<br(/?>|\s[^<>]*>)\s*)+', '\n', html_string)
+    html_string = multiple_line_breaks_re.sub('\n', html_string)
 
     return html_string.strip(' \t')
 
 
 def replace_line_breaks_except_pre(html_string, replace_by=' '):
     # Remove all line breaks and empty strings, except pre tag
-    # how to make it in one string? :\
-    pre_ranges = [0]
-    out = ''
+    out = []
+    position = 0
 
     # replace non-breaking space with usual space
     html_string = html_string.replace('\u00A0', ' ')
 
-    # get <pre> start/end postion
+    # text between <pre> blocks is cleaned, <pre> blocks are left untouched (except <br>)
     for x in pre_content_re.finditer(html_string):
-        start, end = x.start(), x.end()
-        pre_ranges.extend((start, end))
-    pre_ranges.append(len(html_string))
-
-    # all odd elements are <pre>, leave them untouched
-    for k in range(1, len(pre_ranges)):
-        part = html_string[pre_ranges[k-1]:pre_ranges[k]]
-        if k % 2 == 0:
-            out += line_breaks_inside_pre.sub('\n', part)
-        else:
-            out += line_breaks_and_empty_strings.sub(replace_by, part)
-    return out
+        start, end = x.span()
+        out.append(line_breaks_and_empty_strings.sub(replace_by, html_string[position:start]))
+        out.append(line_breaks_inside_pre.sub('\n', x.group()))
+        position = end
+    out.append(line_breaks_and_empty_strings.sub(replace_by, html_string[position:]))
+    return ''.join(out)
 
 
 def _create_element(element, text=None):
@@ -116,25 +147,105 @@ def _wrap_tag(element, wrapper):
 def _wrap_figure(element):
     figure = _create_element('figure')
     element.addprevious(figure)
-    element.drop_tag()
+    if len(element):
+        element.drop_tag()
+    else:
+        # same as drop_tag(), but without looking up element index in the parent
+        figure.tail = ''.join(x for x in (element.text, element.tail) if x) or None
     element.tail = ''
     figure.append(element)
     return figure
 
 
+def _has_ancestor(element, tag):
+    return next(element.iterancestors(tag), None) is not None
+
+
+def _has_text_node(element):
+    # same as xpath [text()] predicate: empty text nodes count too
+    if element.text is not None:
+        return True
+    return any(child.tail is not None for child in element)
+
+
+def _is_blank(text):
+    return not text or text.isspace()
+
+
+def _find_not_blank(elements):
+    # elements with non-whitespace text_content(), computed bottom-up. elements are in document order,
+    # only their subtrees are walked, and nested elements are visited once
+    not_blank = set()
+    walked = set()
+    for root in elements:
+        if root in walked:
+            continue
+        for event, element in etree.iterwalk(root, events=('end',)):
+            walked.add(element)
+            if not isinstance(element.tag, str):
+                continue
+            if not _is_blank(element.text) or \
+                    any(child in not_blank or not _is_blank(child.tail) for child in element):
+                not_blank.add(element)
+    return not_blank
+
+
+def _first_text_node(element):
+    # same as xpath text() converted to string (first text node only)
+    if element.text is not None:
+        return element.text
+    for child in element:
+        if child.tail is not None:
+            return child.tail
+    return ''
+
+
+def _append_text(element, last_child, text):
+    # append text after the last child (or to element text if there are no children)
+    if last_child is None:
+        element.text = (element.text or '') + text
+    else:
+        last_child.tail = (last_child.tail or '') + text
+
+
+def _merge_following(element, following, join_string):
+    # same result as appending every following element and dropping its tag,
+    # but text is accumulated and written once per text slot
+    last_child = element[-1] if len(element) else None
+    pending_text = []
+    for current in following:
+        children = current.getchildren()
+        tail = current.tail.strip() if current.tail else None
+        if current.text:
+            pending_text.append(join_string + current.text)
+        current.getparent().remove(current)
+        if children:
+            if pending_text:
+                _append_text(element, last_child, ''.join(pending_text))
+                pending_text = []
+            element.extend(children)
+            last_child = children[-1]
+        if tail:
+            pending_text.append(tail)
+    if pending_text:
+        _append_text(element, last_child, ''.join(pending_text))
+
+
 def join_following_elements(elements, join_string=''):
+    not_joined = set(elements)
     for element in elements:
+        if element not in not_joined:
+            continue
+        following = []
         next_element = element.getnext()
-        while next_element is not None and next_element in elements:
-            current = next_element
+        while next_element is not None and next_element in not_joined:
+            following.append(next_element)
+            not_joined.remove(next_element)
             next_element = next_element.getnext()
-            if current.text:
-                current.text = join_string + current.text
-            if current.tail:
-                current.tail = current.tail.strip()
-            element.append(current)
-            elements.remove(current)
-            current.drop_tag()
+        if following:
+            _merge_following(element, following, join_string)
+    # joined elements are removed from the list
+    elements[:] = [x for x in elements if x in not_joined]
 
 
 def _fragments_from_string(html_string):
@@ -186,13 +297,13 @@ def preprocess_media_tags(element):
                     element.set('src', '/embed/vimeo?url=' + quote_plus('https://vimeo.com/' + vimeo.group(2)))
                 elif telegram:
                     element.set('src', '/embed/telegram?url=' + quote_plus(iframe_src))
-                if not len(element.xpath('./ancestor::figure')):
+                if not _has_ancestor(element, 'figure'):
                     _wrap_figure(element)
             else:
                 element.drop_tag()
 
         elif element.tag == 'blockquote' and element.get('class') == 'twitter-tweet':
-            twitter_links = element.xpath('.//a[@href]')
+            twitter_links = [x for x in element.iter('a') if x.get('href') is not None]
             for tw_link in twitter_links:
                 if twitter_re.match(tw_link.get('href')):
                     twitter_frame = html.HtmlElement()
@@ -204,184 +315,366 @@ def preprocess_media_tags(element):
                     break
 
 
-def move_to_top(body):
-    # this should be improved to include nested elements (like lists)
-    # still buggy
-    elements = body.xpath('./*/figure|./*//blockquote')
-    for element in elements:
-        preceding_elements = element.xpath('./preceding-sibling::*')
-        parent = element.getparent()
-        if len(preceding_elements) > 0 or parent.text and len(parent.text) > 0:
-
-            new_container = _create_element(parent.tag)
-            new_container.text = parent.text
-            parent.text = ''
-            parent.addprevious(new_container)
+def _split_before(element, top):
+    # move everything preceding element inside top into copies of its ancestors, placed before top
+    ancestors = []
+    child = element
+    while child is not top:
+        parent = child.getparent()
+        preceding = []
+        for sibling in parent:
+            if sibling is child:
+                break
+            preceding.append(sibling)
+        ancestors.append((parent, preceding))
+        child = parent
+
+    if not any(preceding or parent.text for parent, preceding in ancestors):
+        return
+
+    container = None
+    for parent, preceding in ancestors:
+        new_container = _create_element(parent.tag)
+        new_container.attrib.update(parent.attrib)
+        new_container.text = parent.text
+        parent.text = ''
+        new_container.extend(preceding)
+        if container is not None:
+            new_container.append(container)
+        container = new_container
+    top.addprevious(container)
 
-            for preceding in preceding_elements:
-                new_container.append(preceding)
 
-        parent_for_figure = element.xpath('./ancestor::*[parent::body]')[0]
+def move_to_top(body):
+    # move figures and nested blockquotes to the top level, splitting their ancestors in two parts
+    elements = [
+        element
+        for top in body.iterchildren()
+        for element in top.iterdescendants('figure', 'blockquote')
+        if element.tag == 'blockquote' or element.getparent() is top
+    ]
+    for element in elements:
+        top = element
+        splittable = True
+        for ancestor in element.iterancestors():
+            if ancestor is body:
+                break
+            top = ancestor
+            splittable = splittable and ancestor.tag not in unsplittable_tags
+        if top is element:
+            continue
+
+        if splittable:
+            _split_before(element, top)
         # tail leaves inside parent
         element.drop_tree()
         element.tail = ''
-        parent_for_figure.addprevious(element)
+        top.addprevious(element)
 
 
-def preprocess_fragments(fragments):
-    bad_tags = []
+def _wrap_top_level_fragments(body):
+    for fragment in body.getchildren():
+        if fragment.tag not in allowed_top_level_tags:
+            paragraph = _create_element('p')
+            fragment.addprevious(paragraph)
+            paragraph.append(fragment)
+        else:
+            # convert and append text nodes after closing tag
+            if fragment.tail and len(fragment.tail.strip()) != 0:
+                paragraph = _create_element('p')
+                paragraph.text = fragment.tail
+                fragment.tail = None
+                fragment.addnext(paragraph)
+
 
+def preprocess_fragments(fragments):
+    # all nodes are classified during one tree walk, then the rules are applied
     if not len(fragments):
         return None
 
     body = fragments[0].getparent()
 
-    # remove para inside blockquote/aside/figure  (telegraph removes it anyway) and replace with line-break
-    paras_inside_quote = body.xpath(
-        './/*[self::blockquote|self::aside|self::figure]//'
-        'p[descendant-or-self::*[text()]][following-sibling::*[text()]]'
-    )
+    bad_tags = []
+    paras_inside_quote = []
+    code_elements = []
+    images = []
+    lists = []
+    open_links = []
+    # number of currently open ancestors
+    depth = dict.fromkeys(('quote', 'blockquote', 'figcaption', 'pre'), 0)
+
+    for event, element in etree.iterwalk(body, events=('start', 'end')):
+        tag = element.tag
+        if element is body or not isinstance(tag, str):
+            continue
+
+        if event == 'start':
+            if depth['figcaption'] or depth['pre']:
+                # figcaption may have only text content, drop all tags inside pre
+                bad_tags.append(element)
+            if tag == 'p' and depth['blockquote']:
+                bad_tags.append(element)
+            elif tag in ('iframe', 'img') and element.get('src') is None:
+                bad_tags.append(element)
+            elif tag == 'img' and element.get('src').strip(' \t\r\n').startswith('data:'):
+                bad_tags.append(element)
+            elif tag in ('ul', 'ol', 'li'):
+                # checked after the walk, when para tails are already replaced
+                lists.append(element)
+
+            if tag == 'a':
+                open_links.append([element, False])
+            elif tag == 'img':
+                images.append(element)
+                for link in open_links:
+                    link[1] = True
+            elif tag == 'code':
+                code_elements.append(element)
+
+            if tag in ('blockquote', 'aside', 'figure'):
+                depth['quote'] += 1
+            if tag in ('blockquote', 'aside'):
+                depth['blockquote'] += 1
+            if tag in ('figcaption', 'pre'):
+                depth[tag] += 1
+        else:
+            if depth['quote']:
+                # para followed by a sibling with text, both inside blockquote/aside/figure
+                following_has_text = False
+                for child in reversed(element):
+                    if not isinstance(child.tag, str):
+                        continue
+                    if child.tag == 'p' and following_has_text and \
+                            any(_has_text_node(x) for x in child.iter() if isinstance(x.tag, str)):
+                        paras_inside_quote.append(child)
+                    following_has_text = following_has_text or _has_text_node(child)
+
+            if tag in ('blockquote', 'aside', 'figure'):
+                depth['quote'] -= 1
+            if tag in ('blockquote', 'aside'):
+                depth['blockquote'] -= 1
+            if tag in ('figcaption', 'pre'):
+                depth[tag] -= 1
+
+            if tag == 'a':
+                link, has_image = open_links.pop()
+                if has_image:
+                    # remove links with images inside
+                    bad_tags.append(link)
+
     for para in paras_inside_quote:
         para.tail = '\n'
 
-    bad_tags.extend(body.xpath('.//*[self::blockquote|self::aside]//p'))
-
-    # remove empty iframes
-    bad_tags.extend(body.xpath('.//iframe[not(@src)]|.//img[not(@src)]'))
-
-    # remove images with data URIs
-    bad_tags.extend(body.xpath('.//img[starts-with(normalize-space(@src), "data:")]'))
-
-    # figcaption may have only text content
-    bad_tags.extend(body.xpath(".//figcaption//*"))
+    # bad lists (remove lists/list items if empty)
+    if lists:
+        not_blank = _find_not_blank(lists)
+        bad_tags.extend([x for x in lists if x not in not_blank])
 
-    # drop all tags inside pre
-    bad_tags.extend(body.xpath(".//pre//*"))
+    # drop each element once
+    dropped = set()
+    for bad_tag in bad_tags:
+        if bad_tag not in dropped:
+            dropped.add(bad_tag)
+            bad_tag.drop_tag()
 
-    # bad lists (remove lists/list items if empty)
-    nodes_not_to_be_empty = body.xpath('.//ul|.//ol|.//li')
-    bad_tags.extend([x for x in nodes_not_to_be_empty if len(x.text_content().strip()) == 0])
-    # remove links with images inside
-    bad_tags.extend(body.xpath('.//a[descendant::img]'))
-    for bad_tag in set(bad_tags):
-        bad_tag.drop_tag()
-
-    # code - > pre
-    # convert multiline code into pre
-    code_elements = body.xpath('.//code')
     for code_element in code_elements:
-        if '\n' in code_element.text_content():
+        if code_element not in dropped and '\n' in code_element.text_content():
             code_element.tag = 'pre'
 
-    for fragment in body.getchildren():
-        if fragment.tag not in allowed_top_level_tags:
-            paragraph = _create_element('p')
-            fragment.addprevious(paragraph)
-            paragraph.append(fragment)
-        else:
-            # convert and append text nodes after closing tag
-            if fragment.tail and len(fragment.tail.strip()) != 0:
-                paragraph = _create_element('p')
-                paragraph.text = fragment.tail
-                fragment.tail = None
-                fragment.addnext(paragraph)
+    _wrap_top_level_fragments(body)
 
-    images_to_wrap = body.xpath('.//img[not(ancestor::figure)]')
-    for image in images_to_wrap:
-        _wrap_figure(image)
+    for image in images:
+        if image not in dropped and not _has_ancestor(image, 'figure'):
+            _wrap_figure(image)
 
     return body if len(body.getchildren()) else None
 
 
 def post_process(body):
-
-    elements_not_empty = './/*[%s]' % '|'.join(['self::' + x for x in elements_with_text])
-    bad_tags = body.xpath(elements_not_empty)
-
-    for x in bad_tags:
-        if len(x.text_content().strip()) == 0:
+    # candidates of every rule are collected during one tree walk
+    text_elements = []
+    pre_elements = []
+    elements_with_class = []
+    figures = []
+
+    for element in body.iterdescendants():
+        tag = element.tag
+        if tag in elements_with_text:
+            text_elements.append(element)
+        elif tag == 'pre':
+            pre_elements.append(element)
+        elif tag == 'figure':
+            figures.append(element)
+        if isinstance(tag, str) and element.get('class') is not None:
+            elements_with_class.append(element)
+
+    # dropping empty tags doesn't change text of other elements
+    not_blank = _find_not_blank(text_elements)
+    for x in text_elements:
+        if x not in not_blank:
             x.drop_tag()
 
     # group following pre elements into single one (telegraph is buggy)
-    join_following_elements(body.xpath('.//pre'), join_string="\n")
+    join_following_elements(pre_elements, join_string="\n")
 
     # remove class attributes for all
-    elements_with_class = body.xpath('.//*[@class]')
     for element in elements_with_class:
-        element.attrib.pop('class')
+        element.attrib.pop('class', None)
 
     # remove empty figure
-    for x in body.xpath('.//figure[not(descendant::*[self::iframe|self::figcaption|self::img|self::video])]'
-                        '[not(normalize-space(text()))]'):
+    empty_figures = [
+        x for x in figures
+        if next(x.iter('iframe', 'figcaption', 'img', 'video'), None) is None and
+        not _first_text_node(x).strip(' \t\r\n')
+    ]
+    for x in empty_figures:
         x.drop_tree()
 
 
-def _recursive_convert(element):
-
-    fragment_root_element = {
-        'tag': element.tag
-    }
-
+NODE_START, NODE_TEXT, NODE_END = range(3)
+
+
+def _iter_nodes(elements):
+    # yields (NODE_START, element), (NODE_TEXT, text) and (NODE_END, element) in document order.
+    # Uses explicit stack, so deeply nested documents don't hit the recursion limit
+    stack = [(None, iter(elements))]
+    while stack:
+        parent, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            if parent is not None:
+                yield NODE_END, parent
+                # text after top level elements is ignored
+                if len(stack) > 1 and parent.tail:
+                    yield NODE_TEXT, parent.tail
+        elif isinstance(child.tag, str):
+            yield NODE_START, child
+            if child.text:
+                yield NODE_TEXT, child.text
+            stack.append((child, iter(child)))
+        elif len(stack) > 1 and child.tail:
+            # skip comments and processing instructions, but keep text after them
+            yield NODE_TEXT, child.tail
+
+
+def _convert_to_list(elements):
     content = []
-    if element.text:
-        content.append(element.text)
-
-    if element.attrib:
-        fragment_root_element.update({
-            'attrs': dict(element.attrib)
-        })
+    stack = [(None, content)]
+    for event, value in _iter_nodes(elements):
+        if event == NODE_TEXT:
+            stack[-1][1].append(value)
+        elif event == NODE_START:
+            node = {'tag': value.tag}
+            if value.attrib:
+                node['attrs'] = dict(value.attrib)
+            stack[-1][1].append(node)
+            stack.append((node, []))
+        else:
+            node, children = stack.pop()
+            if children:
+                node['children'] = children
+    return content
 
-    for child in element:
-        content.append(_recursive_convert(child))
-        # Append Text node after element, if exists
-        if child.tail:
-            content.append(child.tail)
 
-    if len(content):
-        fragment_root_element.update({
-            'children': content
-        })
+def _write_json(elements, write, separators=(', ', ': ')):
+    # writes the same json as json.dumps(_convert_to_list(elements), ensure_ascii=False, separators=separators)
+    item_separator, key_separator = separators
+    encode = json.encoder.encode_basestring
+    children_key = item_separator + encode('children') + key_separator + '['
+    tag_key = '{' + encode('tag') + key_separator
+    attrs_key = item_separator + encode('attrs') + key_separator + '{'
+    # has_children[-1] is True when the current node already has written children
+    has_children = [False]
+
+    write('[')
+    for event, value in _iter_nodes(elements):
+        if event == NODE_END:
+            write(']}' if has_children.pop() else '}')
+            continue
+
+        if has_children[-1]:
+            write(item_separator)
+        elif len(has_children) > 1:
+            write(children_key)
+        has_children[-1] = True
+
+        if event == NODE_TEXT:
+            write(encode(value))
+        else:
+            write(tag_key + encode(value.tag))
+            if value.attrib:
+                write(attrs_key + item_separator.join(
+                    encode(key) + key_separator + encode(attr) for key, attr in value.attrib.items()
+                ) + '}')
+            has_children.append(False)
+    write(']')
 
-    return fragment_root_element
 
+def _escape_html(text, quote_char=False):
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return text.replace('"', '&quot;') if quote_char else text
 
-def _recursive_convert_json(element):
 
-    content = _create_element(element.get('tag'))
+def _json_attribute_to_html(tag, name, value, base_url):
+    if name in link_attrs:
+        value = urljoin(base_url, value.strip())
+    if name in uri_attributes or name == 'name' and tag == 'a':
+        value = quote(value, safe=uri_safe_characters)
+    return ' %s="%s"' % (name, _escape_html(value, quote_char=True))
 
-    attributes = element.get('attrs')
-    if attributes:
-        # preserve order to conform the tests
-        for attr in [(key, attributes[key]) for key in sorted(attributes.keys())]:
-            content.set(attr[0], attr[1])
-    children = element.get('children') or []
-    for child in children:
-        if not isinstance(child, (dict, list)):
-            # temporarily wrap text with span tag
-            content.append(_create_element('span', text=child))
-        else:
-            content.append(_recursive_convert_json(child))
 
-    return content
+def _json_text_to_html(texts, preformatted):
+    text = _escape_html(''.join(texts).replace('\u00A0', ' '))
+    return text if preformatted else line_breaks_and_empty_strings.sub('<br/>', text)
 
 
 def convert_json_to_html(elements, base_url='http://telegra.ph'):
-    content = html.fragment_fromstring('<div></div>')
-    for element in elements:
-        content.append(_recursive_convert_json(element))
-    content.make_links_absolute(base_url=base_url)
-    for x in content.xpath('.//span'):
-        x.drop_tag()
-    html_string = html.tostring(content, encoding='unicode')
-    html_string = replace_line_breaks_except_pre(html_string, '<br/>')
-    html_string = html_string[5:-6]
-    return html_string
-
-
-def convert_html_to_telegraph_format(html_string, clean_html=True, output_format=OutputFormat.JSON_STRING):
+    # writes html directly from telegraph nodes: links are made absolute, line breaks outside <pre>
+    # are replaced by <br/> and <br> inside <pre> by line breaks
+    out = []
+    # adjacent text nodes are cleaned together
+    texts = []
+    # (tag, children iterator, is inside pre/code)
+    stack = [(None, iter(elements), False)]
+    while stack:
+        tag, children, preformatted = stack[-1]
+        child = next(children, None)
+        if isinstance(child, str):
+            texts.append(child)
+            continue
+        if texts:
+            out.append(_json_text_to_html(texts, preformatted))
+            texts = []
+
+        if child is None:
+            stack.pop()
+            if tag is not None:
+                out.append('</%s>' % tag)
+            continue
+
+        child_tag = child.get('tag')
+        child_children = child.get('children') or []
+        if child_tag == 'br' and preformatted:
+            out.append('\n')
+            continue
+
+        attributes = child.get('attrs') or {}
+        out.append('<%s%s>' % (child_tag, ''.join(
+            # preserve order to conform the tests
+            _json_attribute_to_html(child_tag, name, attributes[name], base_url) for name in sorted(attributes)
+        )))
+        if child_tag in void_tags:
+            continue
+        if child_tag in no_end_tag_if_empty and not any(x for x in child_children):
+            continue
+        stack.append((child_tag, iter(child_children), preformatted or child_tag in ('pre', 'code')))
+    return ''.join(out)
+
+
+def _convert_html_to_body(html_string, clean_html=True):
     if clean_html:
         html_string = clean_article_html(html_string)
-
         body = preprocess_fragments(
             _fragments_from_string(html_string)
         )
@@ -394,14 +687,198 @@ def convert_html_to_telegraph_format(html_string, clean_html=True, output_format
     else:
         fragments = _fragments_from_string(html_string)
         body = fragments[0].getparent() if len(fragments) else None
+    return body
+
+
+def write_telegraph_json(html_string, fp, clean_html=True):
+    """
+        Converts html and writes telegraph nodes as json directly to the file-like object
+    :param html_string: html to convert
+    :param fp: text file-like object, only fp.write() is used
+    :param clean_html: same as for convert_html_to_telegraph_format
+    """
+    body = _convert_html_to_body(html_string, clean_html)
+    _write_json(body.iterchildren() if body is not None else (), fp.write)
 
-    content = []
-    if body is not None:
-        content = [_recursive_convert(x) for x in body.iterchildren()]
+
+def convert_html_to_telegraph_format(html_string, clean_html=True, output_format=OutputFormat.JSON_STRING):
+    body = _convert_html_to_body(html_string, clean_html)
+    elements = body.iterchildren() if body is not None else ()
 
     if output_format == OutputFormat.JSON_STRING:
-        return json.dumps(content, ensure_ascii=False)
+        chunks = []
+        _write_json(elements, chunks.append)
+        return ''.join(chunks)
     elif output_format == OutputFormat.PYTHON_LIST:
-        return content
+        return _convert_to_list(elements)
     elif output_format == OutputFormat.HTML_STRING:
         return html.tostring(body, encoding='unicode')
+
+
+def _measure_nodes(elements):
+    # returns size of json written by _write_json(elements, write, (',', ':')) in utf-8 bytes,
+    # number of elements and text nodes, max depth of elements, sets of tags and attribute names.
+    # Only the size is counted, the node list and the json string are not built
+    encode = json.encoder.encode_basestring
+    # all strings are encoded at once, utf-8 length of every small string is slower
+    strings = []
+    size = 2
+    nodes = depth = 0
+    tags = set()
+    attributes = set()
+    has_children = [False]
+    for event, value in _iter_nodes(elements):
+        if event == NODE_END:
+            size += 2 if has_children.pop() else 1
+            continue
+
+        if has_children[-1]:
+            size += 1
+        elif len(has_children) > 1:
+            size += len(',"children":[')
+        has_children[-1] = True
+        nodes += 1
+
+        if event == NODE_TEXT:
+            strings.append(value)
+            size += 2
+        else:
+            strings.append(value.tag)
+            tags.add(value.tag)
+            size += len('{"tag":""')
+            if value.attrib:
+                strings.extend(value.attrib.keys())
+                strings.extend(value.attrib.values())
+                attributes.update(value.attrib.keys())
+                # ',"attrs":{}', quotes of names and values, colons and commas
+                size += 11 + 6 * len(value.attrib) - 1
+            has_children.append(False)
+            depth = max(depth, len(has_children) - 1)
+    # quotes around the joined string are already counted
+    size += len(encode(''.join(strings)).encode('utf-8')) - 2
+    return size, nodes, depth, tags, attributes
+
+
+def _content_size_bound(html_string):
+    # upper bound of the size measured by _measure_nodes after conversion with clean_html, from the html only.
+    # A byte of html becomes at most 3 bytes of json (escaped quotes, %-quoted urls of embeds),
+    # every tag adds at most 64 bytes of node syntax and elements like figure created around it
+    return 3 * len(html_string.encode('utf-8')) + 64 * html_string.count('<') + 64
+
+
+def _node_size(node):
+    return len(json.dumps(node, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def split_telegraph_content(html_string, max_size=max_content_size, clean_html=True):
+    """
+        Converts html and splits top level nodes into parts, so that every part is accepted by telegra.ph.
+        Size is measured for each node while the list is built, so content is not serialized as a whole.
+    :param html_string: html to convert
+    :param max_size: max size of the part in bytes, as compact utf-8 json
+    :param clean_html: same as for convert_html_to_telegraph_format
+    :return: list of parts, every part is a list of telegraph nodes (same as OutputFormat.PYTHON_LIST)
+    """
+    body = _convert_html_to_body(html_string, clean_html)
+    parts = [[]]
+    # size of "[]"
+    part_size = 2
+    for element in body.iterchildren() if body is not None else ():
+        if not isinstance(element.tag, str):
+            continue
+        node = _convert_to_list([element])[0]
+        size = _node_size(node)
+        if size + 2 > max_size:
+            raise TelegraphContentTooBigError(
+                'Content is too big: <%s> at top level takes %d bytes' % (element.tag, size)
+            )
+        if parts[-1]:
+            # comma before the node
+            size += 1
+            if part_size + size > max_size:
+                parts.append([])
+                part_size = 2
+                size -= 1
+        parts[-1].append(node)
+        part_size += size
+    return parts
+
+
+ConversionResult = namedtuple('ConversionResult', ('index', 'content', 'error'))
+
+
+def _convert_chunk(chunk, clean_html, output_format):
+    # runs in worker process: compiled regexes and default_cleaner are created once per worker on import
+    results = []
+    for index, html_string in chunk:
+        try:
+            results.append(ConversionResult(
+                index, convert_html_to_telegraph_format(html_string, clean_html, output_format), None
+            ))
+        except Exception as e:
+            results.append(ConversionResult(index, None, e))
+    return results
+
+
+def _iter_chunks(html_strings, chunksize):
+    chunk = []
+    for item in enumerate(html_strings):
+        chunk.append(item)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def convert_many(html_strings, workers=None, chunksize=16, ordered=True, clean_html=True,
+                 output_format=OutputFormat.JSON_STRING):
+    """
+        Converts many html documents in a process pool.
+        Input is read lazily, only a few chunks per worker are converted ahead of the consumer.
+    :param html_strings: iterable of html strings
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param chunksize: number of documents sent to a worker at once
+    :param ordered: if true, results are returned in input order, otherwise as soon as they are ready
+    :param clean_html: same as for convert_html_to_telegraph_format
+    :param output_format: same as for convert_html_to_telegraph_format
+    :return: iterator of ConversionResult(index, content, error) objects. If conversion of the document failed,
+        content is None and error contains the exception, other documents are still converted
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = _iter_chunks(html_strings, chunksize)
+    pending = deque()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        max_pending = workers * 2
+
+        def submit_next():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                future = executor.submit(_convert_chunk, chunk, clean_html, output_format)
+                pending.append((future, chunk))
+            return chunk is not None
+
+        def chunk_results(future, chunk):
+            try:
+                return future.result()
+            except Exception as e:
+                # worker process died or result could not be sent back
+                return [ConversionResult(index, None, e) for index, _ in chunk]
+
+        try:
+            while len(pending) < max_pending and submit_next():
+                pass
+            while pending:
+                if ordered:
+                    future, chunk = pending.popleft()
+                else:
+                    concurrent.futures.wait([x[0] for x in pending], return_when=concurrent.futures.FIRST_COMPLETED)
+                    future, chunk = next(x for x in pending if x[0].done())
+                    pending.remove((future, chunk))
+                submit_next()
+                for result in chunk_results(future, chunk):
+                    yield result
+        finally:
+            for future, _ in pending:
+                future.cancel()
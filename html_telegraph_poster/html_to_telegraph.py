@@ -1,27 +1,84 @@
 # encoding=utf8
+import calendar
+import concurrent.futures
+import hashlib
+import io
 import json
 import os
+import time
+from datetime import datetime, timedelta
+from collections import deque, namedtuple
 import requests
+from requests.adapters import HTTPAdapter
 from requests_toolbelt import MultipartEncoder
+from urllib3.util.retry import Retry
 from .errors import *
 from .converter import convert_html_to_telegraph_format, convert_json_to_html, OutputFormat
+from .converter import split_telegraph_content, max_content_size, allowed_tags
+from .converter import _convert_html_to_body, _measure_nodes, _write_json, _content_size_bound, _node_size
+from .upload_images import ImageUploader
+from .utils import DocumentPreprocessor
 
 base_url = 'http://telegra.ph'
 save_url = 'https://edit.telegra.ph/save'
 api_url = 'https://api.telegra.ph'
 default_user_agent = 'Python_telegraph_poster/0.1'
 
+# space left in every part for links to the next and previous parts
+part_link_reserve = 1024
+# part of the reserve for the url of the linked page, the rest is for the link node and its text
+part_url_reserve = 384
 
-def _upload(title, author, text,
-            author_url='', tph_uuid=None, page_id=None, user_agent=default_user_agent, convert_html=True,
-            clean_html=True, telegraph_base_url=base_url):
+# the only attributes accepted by telegra.ph api
+allowed_attributes = ('href', 'src')
+
+# max limit of getPageList
+max_page_list_limit = 200
+
+PublishResult = namedtuple('PublishResult', ('index', 'page', 'error'))
+ViewsTable = namedtuple('ViewsTable', ('path', 'bucket', 'views', 'errors', 'fetched_at'))
+PayloadEstimate = namedtuple('PayloadEstimate', (
+    'size', 'content_size', 'node_count', 'depth', 'rejected_tags', 'rejected_attributes', 'exact'
+))
+
+
+def create_session(pool_size=10, max_retries=3, backoff_factor=0.3):
+    """
+        Creates requests session with keep-alive connection pool, shared by all requests of TelegraphPoster
+    :param pool_size: max number of connections kept open per host
+    :param max_retries: number of retries for failed connections (and failed idempotent requests)
+    :param backoff_factor: delay between retries is backoff_factor * (2 ** retry number) seconds
+    :return: requests.Session object
+    """
+    session = requests.Session()
+    retries = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=(502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
+
+def _convert(text, clean_html, output_format=OutputFormat.JSON_STRING, conversion_cache=None):
+    if conversion_cache is not None:
+        return conversion_cache.convert(text, clean_html, output_format)
+    return convert_html_to_telegraph_format(text, clean_html, output_format=output_format)
+
+
+def _send_limited(rate_limiter, access_token, endpoint, func, *args):
+    if rate_limiter is None:
+        return func(*args)
+    return rate_limiter.call(access_token, endpoint, func, *args)
+
+
+def _prepare_upload(title, author, text, author_url='', tph_uuid=None, page_id=None, user_agent=default_user_agent,
+                    convert_html=True, clean_html=True, telegraph_base_url=base_url, conversion_cache=None):
+    # returns headers, cookies and body of the request to save_url
     if not title:
         raise TitleRequiredError('Title is required')
     if not text:
         raise TextRequiredError('Text is required')
 
-    content = convert_html_to_telegraph_format(text, clean_html) if convert_html else text
+    content = _convert(text, clean_html, conversion_cache=conversion_cache) if convert_html else text
     cookies = dict(tph_uuid=tph_uuid) if tph_uuid and page_id else None
 
     fields = {
@@ -41,18 +98,39 @@ def _upload(title, author, text,
         'User-Agent': user_agent,
         'Origin': telegraph_base_url
     }
-    with requests.Session() as r:
-        r.mount('https://', requests.adapters.HTTPAdapter(max_retries=3))
-
-        response = r.post(save_url, timeout=4, headers=headers, cookies=cookies, data=m.to_string())
-        result = json.loads(response.text)
-        if 'path' in result:
-            result['tph_uuid'] = response.cookies.get('tph_uuid') or tph_uuid
-            result['url'] = telegraph_base_url + '/' + result['path']
-            return result
-        else:
-            error_msg = result['error'] if 'error' in result else ''
-            raise TelegraphError(error_msg)
+    return headers, cookies, m.to_string()
+
+
+def _upload_result(result, tph_uuid=None, telegraph_base_url=base_url):
+    if 'path' in result:
+        result['tph_uuid'] = tph_uuid
+        result['url'] = telegraph_base_url + '/' + result['path']
+        return result
+    else:
+        error_msg = result['error'] if 'error' in result else ''
+        raise TelegraphError(error_msg)
+
+
+def _send_upload(headers, cookies, data, tph_uuid=None, telegraph_base_url=base_url, session=None, rate_limiter=None):
+
+    def send(session):
+        response = session.post(save_url, timeout=4, headers=headers, cookies=cookies, data=data)
+        return _upload_result(json.loads(response.text), response.cookies.get('tph_uuid') or tph_uuid,
+                              telegraph_base_url)
+
+    if session is None:
+        with create_session(pool_size=1) as session:
+            return _send_limited(rate_limiter, tph_uuid, 'save', send, session)
+    return _send_limited(rate_limiter, tph_uuid, 'save', send, session)
+
+
+def _upload(title, author, text,
+            author_url='', tph_uuid=None, page_id=None, user_agent=default_user_agent, convert_html=True,
+            clean_html=True, telegraph_base_url=base_url, conversion_cache=None, session=None, rate_limiter=None):
+
+    headers, cookies, data = _prepare_upload(title, author, text, author_url, tph_uuid, page_id, user_agent,
+                                             convert_html, clean_html, telegraph_base_url, conversion_cache)
+    return _send_upload(headers, cookies, data, tph_uuid, telegraph_base_url, session, rate_limiter)
 
 
 def _prepare_page_upload_params(params):
@@ -60,23 +138,81 @@ def _prepare_page_upload_params(params):
     return json.dumps(params, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
 
-def _upload_via_api(title, author, text, author_url='', access_token=None, user_agent=default_user_agent,
-                    convert_html=True,  clean_html=True, path=None, telegraph_api_url=api_url):
+def _prepare_api_upload(title, author, text, author_url='', access_token=None, user_agent=default_user_agent,
+                        convert_html=True, clean_html=True, path=None, telegraph_api_url=api_url,
+                        conversion_cache=None):
+    # returns url, body and headers of createPage/editPage request
+    if convert_html and conversion_cache is None:
+        # nodes are written to the body as json while the tree is walked, without list of nodes
+        _check_api_upload(title, text, access_token)
+        body = _convert_html_to_body(text, clean_html)
+        params = _page_upload_params(title, author or '', author_url or '', access_token, None, path)
+        return _api_upload_request(params, user_agent, telegraph_api_url,
+                                   body.iterchildren() if body is not None else ())
+    params = _api_upload_params(title, author, text, author_url, access_token, convert_html, clean_html, path,
+                                conversion_cache)
+    return _api_upload_request(params, user_agent, telegraph_api_url)
+
 
+def _check_api_upload(title, text, access_token):
     if not title:
         raise TitleRequiredError('Title is required')
     if not text:
         raise TextRequiredError('Text is required')
     if not access_token:
         raise APITokenRequiredError('API token is required')
+
+
+def _api_upload_params(title, author, text, author_url='', access_token=None, convert_html=True, clean_html=True,
+                       path=None, conversion_cache=None):
+    _check_api_upload(title, text, access_token)
     if not author:
         author = ''  # author is optional
     if not author_url:
         author_url = ''  # author_url is optional
 
-    content = convert_html_to_telegraph_format(text, clean_html, output_format=OutputFormat.PYTHON_LIST) if convert_html else text
-    method = '/createPage' if not path else '/editPage'
+    content = _convert(text, clean_html, OutputFormat.PYTHON_LIST, conversion_cache) if convert_html else text
+    return _page_upload_params(title, author, author_url, access_token, content, path)
+
 
+def _api_upload_request(params, user_agent=default_user_agent, telegraph_api_url=api_url, elements=None):
+    # elements are lxml elements written as content instead of params['content']
+    method = '/createPage' if not params.get('path') else '/editPage'
+    request_headers = {
+        'User-Agent': user_agent,
+        'Content-Type': 'application/json'
+    }
+    if elements is None:
+        data = _prepare_page_upload_params(params)
+    else:
+        data = _page_upload_body(params, elements)
+    return telegraph_api_url + method, data, request_headers
+
+
+def _page_upload_body(params, elements):
+    # same bytes as _prepare_page_upload_params() with content of the elements. Json is encoded in small pieces
+    # to one buffer, so there is no json string of the whole request and no copy of the buffer
+    buffer = io.BytesIO()
+    envelope = dict((k, v) for k, v in params.items() if k not in ('content', 'path'))
+    buffer.write(_prepare_page_upload_params(envelope)[:-1] + b',"content":')
+    pieces = []
+
+    def write(piece):
+        pieces.append(piece)
+        if len(pieces) >= 1024:
+            buffer.write(''.join(pieces).encode('utf-8'))
+            del pieces[:]
+
+    _write_json(elements, write, (',', ':'))
+    buffer.write(''.join(pieces).encode('utf-8'))
+    if params.get('path'):
+        buffer.write(b',"path":' + _prepare_page_upload_params(params['path']))
+    buffer.write(b'}')
+    # BytesIO gives its buffer away when nothing else uses it
+    return buffer.getvalue()
+
+
+def _page_upload_params(title, author, author_url, access_token, content, path=None):
     params = {
         'access_token': access_token,
         'title': title[:256],
@@ -84,14 +220,80 @@ def _upload_via_api(title, author, text, author_url='', access_token=None, user_
         'author_url': author_url[:512],
         'content': content,
     }
-    request_headers = {
-        'User-Agent': user_agent,
-        'Content-Type': 'application/json'
-    }
     if path:
         params.update({'path': path})
+    return params
+
+
+def estimate_payload(html_string, title='', author='', author_url='', access_token='', path=None, clean_html=True,
+                     max_size=None):
+    """
+        Measures createPage/editPage request without sending it.
+        Exact measurement converts html, so it costs about as much as the conversion itself, only the node list
+        and json are not built. With max_size, html which is surely smaller is not converted.
+    :param html_string: html to check
+    :param title: same as for TelegraphPoster.post(), used to count the exact request size
+    :param author: same as for TelegraphPoster.post()
+    :param author_url: same as for TelegraphPoster.post()
+    :param access_token: access token which will be used for the request
+    :param path: path of the page if it will be edited
+    :param clean_html: same as for convert_html_to_telegraph_format
+    :param max_size: content size limit the caller checks, e.g. max_content_size. If clean_html is True and
+        the upper bound of content size computed from html length and number of tags is below it,
+        the estimate is returned without conversion
+    :return: PayloadEstimate(size, content_size, node_count, depth, rejected_tags, rejected_attributes, exact),
+        size is the request body size in bytes, content_size is compared with max_content_size by telegra.ph.
+        node_count counts elements and text nodes, rejected_tags and rejected_attributes are sets of names
+        which telegra.ph doesn't accept (possible only when clean_html is False).
+        If exact is False, size and content_size are upper bounds, node_count and depth are None
+    """
+    # the request without content, "0" is replaced by content
+    params = _page_upload_params(title or '', author or '', author_url or '', access_token, 0, path)
+    params_size = len(_prepare_page_upload_params(params)) - 1
+    if clean_html and max_size is not None:
+        content_size = _content_size_bound(html_string)
+        if content_size < max_size:
+            return PayloadEstimate(params_size + content_size, content_size, None, None, set(), set(), False)
+
+    body = _convert_html_to_body(html_string, clean_html)
+    content_size, node_count, depth, tags, attributes = _measure_nodes(
+        body.iterchildren() if body is not None else ()
+    )
+    return PayloadEstimate(params_size + content_size, content_size, node_count, depth, tags.difference(allowed_tags),
+                           attributes.difference(allowed_attributes), True)
+
+
+def _page_digest(params):
+    # hash of everything editPage changes, access token and path are not included
+    page = [params['title'], params['author_name'], params['author_url'], params['content']]
+    return hashlib.sha256(json.dumps(page, ensure_ascii=False, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def _views_bucket(bucket):
+    # (year, month, day, hour) with trailing parts omitted, () means total views
+    parts = list(bucket or ())
+    while parts and parts[-1] is None:
+        parts.pop()
+    # None before a set part would shift it to another field, e.g. day would be sent as month
+    if len(parts) > 4 or None in parts:
+        raise ValueError('Bucket must be (year, month, day, hour) or its prefix: %r' % (bucket,))
+    return tuple(parts)
+
+
+def _views_bucket_end(bucket):
+    # unix time when the bucket is over (UTC), None for total views
+    if not bucket:
+        return None
+    if len(bucket) == 1:
+        end = datetime(bucket[0] + 1, 1, 1)
+    elif len(bucket) == 2:
+        end = datetime(bucket[0] + bucket[1] // 12, bucket[1] % 12 + 1, 1)
+    else:
+        end = datetime(*(bucket + (0,))[:4]) + (timedelta(days=1) if len(bucket) == 3 else timedelta(hours=1))
+    return calendar.timegm(end.timetuple())
+
 
-    resp = requests.post(telegraph_api_url + method, data=_prepare_page_upload_params(params), headers=request_headers).json()
+def _api_result(resp):
     if resp['ok'] is True:
         return resp.get('result')
     else:
@@ -99,7 +301,26 @@ def _upload_via_api(title, author, text, author_url='', access_token=None, user_
         raise TelegraphError(error_msg)
 
 
-def create_api_token(short_name, author_name=None, author_url=None, user_agent=default_user_agent):
+def _send_api_upload(url, data, headers, access_token=None, session=None, rate_limiter=None):
+
+    def send():
+        return _api_result((session or requests).post(url, data=data, headers=headers).json())
+
+    # url ends with /createPage or /editPage
+    return _send_limited(rate_limiter, access_token, url.rsplit('/', 1)[1], send)
+
+
+def _upload_via_api(title, author, text, author_url='', access_token=None, user_agent=default_user_agent,
+                    convert_html=True,  clean_html=True, path=None, telegraph_api_url=api_url, conversion_cache=None,
+                    session=None, rate_limiter=None):
+
+    url, data, headers = _prepare_api_upload(title, author, text, author_url, access_token, user_agent, convert_html,
+                                             clean_html, path, telegraph_api_url, conversion_cache)
+    return _send_api_upload(url, data, headers, access_token, session, rate_limiter)
+
+
+def create_api_token(short_name, author_name=None, author_url=None, user_agent=default_user_agent,
+                     telegraph_api_url=api_url, session=None):
     params = {
         'short_name': short_name,
     }
@@ -108,7 +329,7 @@ def create_api_token(short_name, author_name=None, author_url=None, user_agent=d
     if author_url:
         params.update({'author_url': author_url})
 
-    resp = requests.get(api_url+'/createAccount', params, headers={'User-Agent': user_agent})
+    resp = (session or requests).get(telegraph_api_url + '/createAccount', params, headers={'User-Agent': user_agent})
     json_data = resp.json()
     return json_data['result']
 
@@ -119,7 +340,17 @@ def upload_to_telegraph(title, author, text, author_url='', tph_uuid=None, page_
 
 class TelegraphPoster(object):
     def __init__(self, tph_uuid=None, page_id=None, user_agent=default_user_agent, clean_html=True, convert_html=True,
-                 use_api=False, access_token=None, telegraph_api_url=api_url, telegraph_base_url=base_url):
+                 use_api=False, access_token=None, telegraph_api_url=api_url, telegraph_base_url=base_url,
+                 conversion_cache=None, session=None, rate_limiter=None, skip_unchanged=False):
+        """
+        :param session: requests.Session used for all requests, see create_session().
+            If not passed, TelegraphPoster creates its own session and closes it in close()
+        :param rate_limiter: RateLimiter shared with other posters, requests wait for it and are repeated
+            after FLOOD_WAIT errors
+        :param skip_unchanged: api only. Remember hash of the last published content and metadata of every path,
+            and don't send edits which wouldn't change the page, the result of the last edit is returned instead.
+            Edits made by other posters are not known, see published attribute
+        """
         self.title = None
         self.author = None
         self.author_url = None
@@ -135,16 +366,45 @@ class TelegraphPoster(object):
         self.use_api = use_api
         self.telegraph_api_url = telegraph_api_url
         self.telegraph_base_url = telegraph_base_url
+        # ConversionCache instance, reused when the same html is posted again
+        self.conversion_cache = conversion_cache
+        self._own_session = session is None
+        self.session = create_session() if session is None else session
+        self.rate_limiter = rate_limiter
+        self.skip_unchanged = skip_unchanged
+        # path -> (hash, result) of the last published version, when skip_unchanged is True
+        self.published = {}
+        self.skipped_edits = 0
         if self.access_token:
             # use api anyway
             self.use_api = True
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+            Closes connections of the session created by TelegraphPoster
+        """
+        if self._own_session:
+            self.session.close()
+
     def _api_request(self, method, params=None):
         params = params or {}
         if self.access_token:
             params['access_token'] = self.access_token
-        resp = requests.get(self.telegraph_api_url + '/' + method, params, headers={'User-Agent': self.user_agent})
-        return resp.json()
+        return _send_limited(self.rate_limiter, self.access_token, method, self._send_api_request, method, params)
+
+    def _send_api_request(self, method, params):
+        resp = self.session.get(self.telegraph_api_url + '/' + method, params, headers={'User-Agent': self.user_agent})
+        json_response = resp.json()
+        if self.rate_limiter is not None and 'FLOOD_WAIT_' in json_response.get('error', ''):
+            # let rate limiter repeat the request
+            raise TelegraphError(json_response['error'])
+        return json_response
 
     def post(self, title, author, text, author_url=''):
         self.path = None
@@ -166,9 +426,16 @@ class TelegraphPoster(object):
             'author_url': author_url or self.author_url,
             'user_agent': self.user_agent,
             'clean_html': self.clean_html,
-            'convert_html': self.convert_html
+            'convert_html': self.convert_html,
+            'conversion_cache': self.conversion_cache,
+            'session': self.session,
+            'rate_limiter': self.rate_limiter
         }
-        if self.use_api:
+        if self.use_api and self.skip_unchanged:
+            result = self._edit_if_changed(path or self.path, params)
+            self.path = result['path']
+            return result
+        elif self.use_api:
             params['telegraph_api_url'] = self.telegraph_api_url
             result = _upload_via_api(access_token=self.access_token, path=path or self.path, **params)
             self.path = result['path']
@@ -180,6 +447,167 @@ class TelegraphPoster(object):
                 **params
             )
 
+    def _edit_if_changed(self, path, params):
+        page = _api_upload_params(params['title'], params['author'], params['text'], params['author_url'],
+                                  self.access_token, self.convert_html, self.clean_html, path, self.conversion_cache)
+        digest = _page_digest(page)
+        if path and path in self.published and self.published[path][0] == digest:
+            self.skipped_edits += 1
+            return dict(self.published[path][1])
+        url, data, headers = _api_upload_request(page, self.user_agent, self.telegraph_api_url)
+        result = _send_api_upload(url, data, headers, self.access_token, self.session, self.rate_limiter)
+        self.published[result['path']] = (digest, dict(result))
+        return result
+
+    def _prepare_publish(self, job, uploader, images_base_url):
+        title, author, text = job[:3]
+        author_url = job[3] if len(job) > 3 else ''
+        if uploader is not None:
+            document = DocumentPreprocessor(text)
+            document.upload_all_images(images_base_url, uploader=uploader)
+            text = document.get_processed_html()
+        if self.use_api:
+            return _prepare_api_upload(title, author, text, author_url, self.access_token, self.user_agent,
+                                       self.convert_html, self.clean_html, None, self.telegraph_api_url,
+                                       self.conversion_cache)
+        return _prepare_upload(title, author, text, author_url, None, None, self.user_agent, self.convert_html,
+                               self.clean_html, self.telegraph_base_url, self.conversion_cache)
+
+    def _send_publish(self, request):
+        if self.use_api:
+            return _send_api_upload(*request, access_token=self.access_token, session=self.session,
+                                    rate_limiter=self.rate_limiter)
+        return _send_upload(*request, telegraph_base_url=self.telegraph_base_url, session=self.session,
+                            rate_limiter=self.rate_limiter)
+
+    def publish_many(self, jobs, workers=4, prepare_workers=2, upload_images=False, images_base_url=None,
+                     ordered=True, image_cache=None, uploader=None):
+        """
+            Creates many pages. Images of the next pages are uploaded and html is converted while previous pages
+            are being sent. Requests go through rate_limiter if it is set.
+            Doesn't change title, path and other attributes of the poster.
+        :param jobs: iterable of (title, author, html) or (title, author, html, author_url) tuples, read lazily
+        :param workers: max number of pages sent at once
+        :param prepare_workers: number of threads which upload images and convert html
+        :param upload_images: upload images of the page to telegra.ph before publishing, see DocumentPreprocessor
+        :param images_base_url: base url for relative image urls when upload_images is True
+        :param ordered: if true, results are returned in input order, otherwise as soon as they are ready
+        :param image_cache: ImageUploadCache for uploaded images
+        :param uploader: ImageUploader used for images of all pages, so their uploads share one pool and one
+            bandwidth limit. If not passed and upload_images is True, it is created for this call with image_cache
+        :return: iterator of PublishResult(index, page, error) objects. If the page was not published,
+            page is None and error contains the exception, other pages are still published
+        """
+        jobs = enumerate(jobs)
+        max_pending = (workers + prepare_workers) * 2
+        # index -> (future, is_send_stage)
+        pending = {}
+        ready = {}
+        next_index = 0
+        own_uploader = upload_images and uploader is None
+        if own_uploader:
+            uploader = ImageUploader(cache=image_cache)
+        elif not upload_images:
+            uploader = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=prepare_workers) as prepare_executor, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=workers) as send_executor:
+
+            def submit_next():
+                index, job = next(jobs, (None, None))
+                if index is not None:
+                    future = prepare_executor.submit(self._prepare_publish, job, uploader, images_base_url)
+                    pending[index] = (future, False)
+                return index is not None
+
+            try:
+                has_jobs = True
+                while has_jobs or pending or ready:
+                    # results which are waiting for the slow previous page also count, so memory is bounded
+                    while has_jobs and len(pending) + len(ready) < max_pending:
+                        has_jobs = submit_next()
+                    if pending:
+                        concurrent.futures.wait([x[0] for x in pending.values()],
+                                                return_when=concurrent.futures.FIRST_COMPLETED)
+                    for index, (future, is_send_stage) in list(pending.items()):
+                        if not future.done():
+                            continue
+                        try:
+                            request = future.result()
+                        except Exception as e:
+                            ready[index] = PublishResult(index, None, e)
+                            del pending[index]
+                            continue
+                        if is_send_stage:
+                            ready[index] = PublishResult(index, request, None)
+                            del pending[index]
+                        else:
+                            pending[index] = (send_executor.submit(self._send_publish, request), True)
+                    if ordered:
+                        while next_index in ready:
+                            yield ready.pop(next_index)
+                            next_index += 1
+                    else:
+                        for index in list(ready):
+                            yield ready.pop(index)
+            finally:
+                for future, _ in pending.values():
+                    future.cancel()
+                if own_uploader:
+                    # pages which are already being prepared still upload their images
+                    prepare_executor.shutdown()
+                    uploader.close()
+
+    def post_parts(self, title, author, text, author_url='', max_size=max_content_size,
+                   next_text='Next part', previous_text='Previous part'):
+        """
+            Posts content which doesn't fit into one page. Content is split at top level nodes into several pages,
+            every page has links to the next and previous parts. Titles of the pages get "(1/3)" suffix.
+            Works only with api. Doesn't change title, path and other attributes of the poster.
+        :param max_size: max size of the page content in bytes
+        :param next_text: text of the link to the next part
+        :param previous_text: text of the link to the previous part
+        :return: list of created pages
+        """
+        if not self.access_token:
+            raise APITokenRequiredError('API token is required')
+
+        def link(page, link_text):
+            return {'tag': 'p', 'children': [{'tag': 'a', 'attrs': {'href': page['url']}, 'children': [link_text]}]}
+
+        for link_text in (next_text, previous_text):
+            # the link and the comma before it must fit into the reserve together with the page url
+            if _node_size(link({'url': ''}, link_text)) + 1 > part_link_reserve - part_url_reserve:
+                raise ValueError('Link text is too long: %r' % (link_text,))
+
+        parts = split_telegraph_content(text, max_size - 2 * part_link_reserve, self.clean_html)
+        params = {
+            'author': author,
+            'author_url': author_url,
+            'access_token': self.access_token,
+            'user_agent': self.user_agent,
+            'convert_html': False,
+            'telegraph_api_url': self.telegraph_api_url,
+            'session': self.session,
+            'rate_limiter': self.rate_limiter
+        }
+        if len(parts) == 1:
+            return [_upload_via_api(title, text=parts[0], **params)]
+
+        titles = []
+        pages = []
+        for number, content in enumerate(parts, 1):
+            suffix = ' (%d/%d)' % (number, len(parts))
+            titles.append(title[:256 - len(suffix)] + suffix if title else title)
+            if pages:
+                content.append(link(pages[-1], previous_text))
+            pages.append(_upload_via_api(titles[-1], text=content, **params))
+            if len(pages) > 1:
+                # link to the next part is added when its url is known
+                parts[number - 2].append(link(pages[-1], next_text))
+                pages[-2] = _upload_via_api(titles[-2], text=parts[number - 2], path=pages[-2]['path'], **params)
+        return pages
+
     def get_account_info(self, fields=None):
         """
         Use this method to get information about a Telegraph account.
@@ -245,6 +673,45 @@ class TelegraphPoster(object):
         })
         return json_response.get('result')
 
+    def _get_page_list(self, offset, limit):
+        return _api_result(self._api_request('getPageList', {
+            'offset': offset,
+            'limit': limit
+        }))
+
+    def iter_pages(self, offset=0, limit=max_page_list_limit, prefetch=1):
+        """
+            Iterates over all pages of the account, most recently created first. Next batches of pages are requested
+            while the current one is processed.
+            Offset of every page is offset + number of pages yielded before it, pass it to resume the iteration.
+            Pages created during the iteration shift the offsets of older pages.
+        :param offset: sequential number of the first page
+        :param limit: number of pages requested at once
+        :param prefetch: number of batches requested ahead, with 0 the next batch is requested after
+            the current one is processed
+        :return: generator of Page objects
+        """
+        if prefetch < 0:
+            raise ValueError('prefetch must be 0 or more: %r' % (prefetch,))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(prefetch, 1)) as executor:
+            pending = deque([executor.submit(self._get_page_list, offset, limit)])
+            next_offset = offset + limit
+            try:
+                while pending:
+                    page_list = pending.popleft().result()
+                    # total_count is known after the first batch
+                    while len(pending) < prefetch and next_offset < page_list['total_count']:
+                        pending.append(executor.submit(self._get_page_list, next_offset, limit))
+                        next_offset += limit
+                    for page in page_list['pages']:
+                        yield page
+                    if not pending and next_offset < page_list['total_count']:
+                        pending.append(executor.submit(self._get_page_list, next_offset, limit))
+                        next_offset += limit
+            finally:
+                for future in pending:
+                    future.cancel()
+
     def get_views(self, path, year=None, month=None, day=None, hour=None):
         """
             Use this method to get the number of views for a Telegraph article.
@@ -267,6 +734,66 @@ class TelegraphPoster(object):
             'hour': hour
         }).get('result')
 
+    def _get_views(self, path, bucket):
+        return _api_result(self._api_request('getViews', dict(
+            zip(('year', 'month', 'day', 'hour'), bucket), path=path
+        )))['views']
+
+    def get_views_bulk(self, paths, buckets=None, workers=8, previous=None):
+        """
+            Gets views of many pages for many time buckets. Requests are sent by several threads
+            and go through rate_limiter if it is set.
+        :param paths: paths of the pages
+        :param buckets: (year, month, day, hour) tuples or their prefixes, e.g. (2020, 5) for views in May 2020,
+            () for total views. Time is UTC. By default only total views are requested
+        :param workers: max number of requests sent at once
+        :param previous: ViewsTable returned by earlier call. Views of buckets which were over (and so couldn't change)
+            when it was fetched are copied from it instead of being requested again
+        :return: ViewsTable(path, bucket, views, errors, fetched_at). path, bucket and views are lists with a row
+            for every path and bucket, views is None if the request failed. errors is a list of
+            (path, bucket, exception), fetched_at is unix time of the call
+        """
+        fetched_at = time.time()
+        buckets = [_views_bucket(x) for x in (buckets or [()])]
+        known = {}
+        if previous is not None:
+            for path, bucket, views in zip(previous.path, previous.bucket, previous.views):
+                end = _views_bucket_end(bucket)
+                if views is not None and end is not None and end <= previous.fetched_at:
+                    known[(path, bucket)] = views
+
+        table = ViewsTable([], [], [], [], fetched_at)
+        futures = {}
+        # row, path and bucket of the requests in the pool, at most max_pending of them
+        max_pending = workers * 2
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+
+            def collect(return_when):
+                done, _ = concurrent.futures.wait(futures, return_when=return_when)
+                for future in done:
+                    row, path, bucket = futures.pop(future)
+                    try:
+                        table.views[row] = future.result()
+                    except Exception as e:
+                        table.errors.append((path, bucket, e))
+
+            try:
+                for path in paths:
+                    for bucket in buckets:
+                        table.path.append(path)
+                        table.bucket.append(bucket)
+                        table.views.append(known.get((path, bucket)))
+                        if (path, bucket) in known:
+                            continue
+                        if len(futures) >= max_pending:
+                            collect(concurrent.futures.FIRST_COMPLETED)
+                        futures[executor.submit(self._get_views, path, bucket)] = (len(table.views) - 1, path, bucket)
+                collect(concurrent.futures.ALL_COMPLETED)
+            finally:
+                for future in futures:
+                    future.cancel()
+        return table
+
     def create_api_token(self, short_name, author_name=None, author_url=None):
         """
             Use this method to create a new Telegraph account.
@@ -279,7 +806,8 @@ class TelegraphPoster(object):
             Can be any link, not necessarily to a Telegram profile or channel.
         :return: Account object with the regular fields and an additional access_token field.
         """
-        token_data = create_api_token(short_name, author_name, author_url, self.user_agent)
+        token_data = create_api_token(short_name, author_name, author_url, self.user_agent, self.telegraph_api_url,
+                                      self.session)
         self.use_api = True
         self.account = token_data
         self.access_token = token_data['access_token']
@@ -0,0 +1,134 @@
+# coding=utf8
+import concurrent.futures
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+from .html_to_telegraph import _api_result
+
+SyncResult = namedtuple('SyncResult', ('new', 'changed', 'unchanged', 'removed', 'errors'))
+
+# fields of the page list which change when the page is edited
+meta_fields = ('url', 'title', 'description', 'author_name', 'author_url', 'image_url')
+
+
+def _meta(page):
+    return tuple(page.get(x, '') for x in meta_fields)
+
+
+class PageMirror(object):
+    """
+        Local copy of all pages of the account in sqlite database. sync() reads the page list and downloads content
+        only of new pages and pages whose title, description, author or image changed, so repeated syncs cost
+        one getPageList request per 200 pages plus one getPage request per changed page.
+        telegra.ph doesn't report edit time, so edits of the content only are found when max_age is set.
+        Content is stored as compact zlib compressed Node-JSON.
+    """
+    def __init__(self, poster, path=':memory:', workers=4, max_age=None):
+        """
+        :param poster: TelegraphPoster with access token of the account
+        :param path: sqlite database file
+        :param workers: max number of pages downloaded at once
+        :param max_age: content fetched more than max_age seconds ago is downloaded again, even if the page
+            list shows no changes
+        """
+        self.poster = poster
+        self.path = path
+        self.workers = workers
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS pages (path TEXT PRIMARY KEY, %s, views INTEGER, '
+                         'content BLOB, fetched REAL)' % ', '.join('%s TEXT' % x for x in meta_fields))
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _fetch(self, path):
+        page = _api_result(self.poster._api_request('getPage', {'path': path, 'return_content': True}))
+        content = zlib.compress(json.dumps(page.pop('content'), ensure_ascii=False,
+                                           separators=(',', ':')).encode('utf-8'))
+        return page, content
+
+    def sync(self):
+        """
+            Updates the mirror
+        :return: SyncResult(new, changed, unchanged, removed, errors). new, changed and removed are lists of paths,
+            unchanged is the number of other pages, errors is a list of (path, exception) of pages which were not
+            downloaded, they are downloaded again by the next sync
+        """
+        with self._lock:
+            stored = dict(
+                (row[0], (tuple(row[1:-1]), row[-1]))
+                for row in self._db.execute('SELECT path, %s, fetched FROM pages' % ', '.join(meta_fields))
+            )
+            listed = {}
+            for page in self.poster.iter_pages():
+                listed[page['path']] = page
+
+            now = time.time()
+            new, changed, errors = [], [], []
+            for path, page in listed.items():
+                if path not in stored:
+                    new.append(path)
+                elif stored[path][0] != _meta(page) or \
+                        (self.max_age is not None and stored[path][1] < now - self.max_age):
+                    changed.append(path)
+            removed = [x for x in stored if x not in listed]
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = dict((executor.submit(self._fetch, path), path) for path in new + changed)
+                for future in concurrent.futures.as_completed(futures):
+                    path = futures[future]
+                    try:
+                        page, content = future.result()
+                    except Exception as e:
+                        errors.append((path, e))
+                        continue
+                    # metadata of the listing is stored, so the page is compared with the same fields next time
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO pages (path, %s, views, content, fetched) VALUES (?, %s?, ?, ?)'
+                        % (', '.join(meta_fields), '?, ' * len(meta_fields)),
+                        (path,) + _meta(listed[path]) + (page.get('views', 0), content, now)
+                    )
+
+            for path, page in listed.items():
+                self._db.execute('UPDATE pages SET views = ? WHERE path = ?', (page.get('views', 0), path))
+            self._db.executemany('DELETE FROM pages WHERE path = ?', [(x,) for x in removed])
+            self._db.commit()
+            failed = set(x[0] for x in errors)
+            return SyncResult(
+                [x for x in new if x not in failed], [x for x in changed if x not in failed],
+                len(listed) - len(new) - len(changed), removed, errors
+            )
+
+    def get(self, path):
+        """
+        :return: Page object with content as list of nodes, or None if the page is not in the mirror
+        """
+        with self._lock:
+            row = self._db.execute('SELECT path, %s, views, content FROM pages WHERE path = ?'
+                                   % ', '.join(meta_fields), (path,)).fetchone()
+        if row is None:
+            return None
+        page = dict(zip(('path',) + meta_fields + ('views',), row[:-1]))
+        page['content'] = json.loads(zlib.decompress(row[-1]).decode('utf-8'))
+        return page
+
+    def paths(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT path FROM pages ORDER BY path')]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,167 @@
+# coding=utf8
+import asyncio
+import threading
+import time
+from .errors import TelegraphFloodWaitError
+
+
+class _Bucket(object):
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.blocked_until = now
+
+
+class RateLimiter(object):
+    """
+        Token bucket rate limiter with a bucket per access token and endpoint.
+        Requests over the limit wait for their turn instead of failing. When telegra.ph answers with FLOOD_WAIT_X,
+        the bucket is blocked for X seconds and the request is sent again.
+        One limiter can be shared by several TelegraphPoster and AsyncTelegraphPoster objects and threads.
+    """
+    def __init__(self, rate=2.0, burst=5, max_flood_retries=3, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param rate: requests per second allowed for each access token and endpoint
+        :param burst: number of requests which can be sent at once after idle time
+        :param max_flood_retries: how many times request is repeated after FLOOD_WAIT error
+        :param clock: function which returns current time in seconds
+        :param sleep: function which blocks acquire() for given number of seconds
+        """
+        self.clock = clock
+        self.sleep = sleep
+        self.rate = float(rate)
+        self.burst = burst
+        self.max_flood_retries = max_flood_retries
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.flood_waits = 0
+
+    def _reserve(self, access_token, endpoint):
+        # takes a token from the bucket and returns seconds to wait before the request can be sent
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get((access_token, endpoint))
+            if bucket is None:
+                bucket = self._buckets[(access_token, endpoint)] = _Bucket(self.burst, now)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            # tokens below zero are reservations of the waiting requests, so they are served in order
+            bucket.tokens -= 1
+            wait = max(-bucket.tokens / self.rate if bucket.tokens < 0 else 0.0, bucket.blocked_until - now)
+            self.requests += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if wait > 0:
+                self.queued += 1
+                self.max_queued = max(self.max_queued, self.queued)
+            return wait
+
+    def _blocked_for(self, access_token, endpoint, waited):
+        # FLOOD_WAIT could come while the request was waiting
+        with self._lock:
+            wait = self._buckets[(access_token, endpoint)].blocked_until - self.clock()
+            if wait > 0:
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, waited + wait)
+            return wait
+
+    def _done_waiting(self):
+        with self._lock:
+            self.queued -= 1
+
+    def acquire(self, access_token=None, endpoint=None):
+        """
+            Blocks until the request to endpoint can be sent
+        :return: seconds waited
+        """
+        wait = self._reserve(access_token, endpoint)
+        waited = 0.0
+        if wait > 0:
+            try:
+                while wait > 0:
+                    self.sleep(wait)
+                    waited += wait
+                    wait = self._blocked_for(access_token, endpoint, waited)
+            finally:
+                self._done_waiting()
+        return waited
+
+    async def acquire_async(self, access_token=None, endpoint=None):
+        """
+            Same as acquire(), but doesn't block event loop
+        """
+        wait = self._reserve(access_token, endpoint)
+        waited = 0.0
+        if wait > 0:
+            try:
+                while wait > 0:
+                    await asyncio.sleep(wait)
+                    waited += wait
+                    wait = self._blocked_for(access_token, endpoint, waited)
+            finally:
+                self._done_waiting()
+        return waited
+
+    def flood_wait(self, access_token, endpoint, seconds):
+        """
+            Blocks all requests to endpoint with this access token for given number of seconds
+        """
+        with self._lock:
+            now = self.clock()
+            bucket = self._buckets.get((access_token, endpoint))
+            if bucket is None:
+                bucket = self._buckets[(access_token, endpoint)] = _Bucket(self.burst, now)
+            bucket.blocked_until = max(bucket.blocked_until, now + seconds)
+            # nothing is sent while blocked, so no burst right after it
+            bucket.tokens = min(bucket.tokens, 0)
+            self.flood_waits += 1
+
+    def call(self, access_token, endpoint, func, *args, **kwargs):
+        """
+            Calls func when the limit allows it, repeats the call after TelegraphFloodWaitError
+        """
+        retries = 0
+        while True:
+            self.acquire(access_token, endpoint)
+            try:
+                return func(*args, **kwargs)
+            except TelegraphFloodWaitError as e:
+                if retries >= self.max_flood_retries:
+                    raise
+                retries += 1
+                self.flood_wait(access_token, endpoint, e.FLOOD_WAIT_IN_SECONDS)
+
+    async def call_async(self, access_token, endpoint, func, *args, **kwargs):
+        """
+            Same as call(), func is a coroutine function
+        """
+        retries = 0
+        while True:
+            await self.acquire_async(access_token, endpoint)
+            try:
+                return await func(*args, **kwargs)
+            except TelegraphFloodWaitError as e:
+                if retries >= self.max_flood_retries:
+                    raise
+                retries += 1
+                self.flood_wait(access_token, endpoint, e.FLOOD_WAIT_IN_SECONDS)
+
+    def stats(self):
+        """
+        :return: dict with number of requests, currently waiting requests (queued), total and max wait time
+            in seconds, and number of FLOOD_WAIT errors
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'queued': self.queued,
+                'max_queued': self.max_queued,
+                'total_wait': self.total_wait,
+                'max_wait': self.max_wait,
+                'flood_waits': self.flood_waits,
+            }
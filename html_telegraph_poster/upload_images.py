@@ -1,11 +1,24 @@
+import concurrent.futures
+import contextlib
+import hashlib
 import mimetypes
+import os
 import re
+import tempfile
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
 
-from io import BytesIO
 base_url = 'http://telegra.ph'
 save_url = 'https://edit.telegra.ph/save'
 upload_file_url = 'https://telegra.ph/upload'
+# telegra.ph doesn't accept bigger files
+max_image_size = 5 * 1024 * 1024
+chunk_size = 64 * 1024
+# images of unknown size bigger than this are kept in a temporary file instead of memory
+spool_size = 1024 * 1024
 
 
 class Error(Exception):
@@ -24,6 +37,10 @@ class FileTypeNotSupported(Error):
     pass
 
 
+class ImageTooBigError(Error):
+    pass
+
+
 def _check_mimetypes(type):
     return type in ('image/jpeg', 'image/png', 'image/gif', 'video/mp4')
 
@@ -37,62 +54,272 @@ def _get_mimetype_from_response_headers(headers):
     return ''
 
 
+def _image_result(src, return_json):
+    if return_json:
+        return [{'src': src}]
+    return base_url + src
+
+
+class _ImageStream(object):
+    # file-like object for MultipartEncoder, reads the image in chunks. len is the number of bytes left
+    def __init__(self, fileobj, length, throttle=None):
+        self.fileobj = fileobj
+        self.len = length
+        self.throttle = throttle
+
+    def read(self, size=-1):
+        size = self.len if size < 0 else min(size, self.len)
+        chunk = self.fileobj.read(size) if size else b''
+        if size and not chunk:
+            raise GetImageRequestError('Image is shorter than expected')
+        self.len -= len(chunk)
+        if self.throttle is not None:
+            self.throttle(len(chunk))
+        return chunk
+
+
+def _read_chunks(fileobj):
+    return iter(lambda: fileobj.read(chunk_size), b'')
+
+
+def _check_size(size, max_size):
+    if size > max_size:
+        raise ImageTooBigError('Image is bigger than %d bytes' % max_size)
+
+
+def _spool(chunks, max_size, hasher, stack):
+    # for images of unknown size: reads the image to a temporary file, memory is used only for small images
+    spool = stack.enter_context(tempfile.SpooledTemporaryFile(max_size=spool_size))
+    length = 0
+    for chunk in chunks:
+        length += len(chunk)
+        _check_size(length, max_size)
+        if hasher is not None:
+            hasher.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return _ImageStream(spool, length)
+
+
+def _file_stream(fileobj, max_size, hasher, stack):
+    seekable = getattr(fileobj, 'seekable', None)
+    if seekable is None or not seekable():
+        return _spool(_read_chunks(fileobj), max_size, hasher, stack)
+    position = fileobj.tell()
+    length = fileobj.seek(0, os.SEEK_END) - position
+    fileobj.seek(position)
+    _check_size(length, max_size)
+    if hasher is not None:
+        for chunk in _read_chunks(fileobj):
+            hasher.update(chunk)
+        fileobj.seek(position)
+    return _ImageStream(fileobj, length)
+
+
 def upload_image(
         file_name_or_url,
         user_agent='Python_telegraph_poster/0.1',
         return_json=False,
         get_timeout=(10.0, 10.0),
-        upload_timeout=(7.0, 7.0)
+        upload_timeout=(7.0, 7.0),
+        cache=None,
+        upload_url=upload_file_url,
+        max_size=max_image_size
     ):
+    """
+        Uploads image to telegra.ph. Image is sent in chunks while it's being downloaded or read from the file,
+        it's not loaded into memory as a whole
+    :param file_name_or_url: url, path to the file or file object with name attribute
+    :param cache: ImageUploadCache, images which were uploaded earlier are not uploaded again.
+        Source url is requested with If-None-Match/If-Modified-Since and not downloaded again if it's not modified.
+        Downloaded image is kept in a temporary file until its hash is checked
+    :param upload_url: telegra.ph upload url
+    :param max_size: ImageTooBigError is raised for bigger images, as soon as the size is known
+    :return: url of the uploaded image, or json response of telegra.ph if return_json is True
+    """
+    return _upload_image(file_name_or_url, user_agent, return_json, get_timeout, upload_timeout, cache, upload_url,
+                         max_size)[0]
 
-    if hasattr(file_name_or_url, 'read') and hasattr(file_name_or_url, 'name'):
-        img = file_name_or_url
-        img_content_type = mimetypes.guess_type(file_name_or_url.name)[0]
-    elif re.match(r'^https?://', file_name_or_url, flags=re.IGNORECASE):
-        try:
-            img = requests.get(file_name_or_url, headers={'User-Agent': user_agent}, timeout=get_timeout)
-        except:
-            raise GetImageRequestError('Url request failed')
 
-        if img.status_code != 200 or 'Content-Type' not in img.headers:
-            raise GetImageRequestError('Url request failed')
+def _upload_image(file_name_or_url, user_agent, return_json, get_timeout, upload_timeout, cache, upload_url,
+                  max_size, session=None, throttle=None):
+    # returns result of upload_image and number of uploaded bytes, None if the image was found in cache
+    http = session or requests
+    source_url = etag = last_modified = None
+    hasher = hashlib.sha256() if cache is not None else None
 
-        img_content_type = _get_mimetype_from_response_headers(img.headers)
-        img = BytesIO(img.content)
+    with contextlib.ExitStack() as stack:
+        if hasattr(file_name_or_url, 'read') and hasattr(file_name_or_url, 'name'):
+            img_content_type = mimetypes.guess_type(file_name_or_url.name)[0]
+            if not _check_mimetypes(img_content_type):
+                raise FileTypeNotSupported('The "%s" filetype is not supported' % img_content_type)
+            img = _file_stream(file_name_or_url, max_size, hasher, stack)
+        elif re.match(r'^https?://', file_name_or_url, flags=re.IGNORECASE):
+            source_url = file_name_or_url
+            request_headers = {'User-Agent': user_agent}
+            cached = cache.get_url(source_url) if cache is not None else None
+            if cached is not None:
+                if cached[1]:
+                    request_headers['If-None-Match'] = cached[1]
+                if cached[2]:
+                    request_headers['If-Modified-Since'] = cached[2]
+            try:
+                response = http.get(file_name_or_url, headers=request_headers, timeout=get_timeout, stream=True)
+            except:
+                raise GetImageRequestError('Url request failed')
+            stack.callback(response.close)
 
-    else:
-        img_content_type = mimetypes.guess_type(file_name_or_url)[0]
-        img = open(file_name_or_url, 'rb').read()
-
-    # simple filecheck, based on file extension
-    if not _check_mimetypes(img_content_type):
-        raise FileTypeNotSupported('The "%s" filetype is not supported' % img_content_type)
-
-    headers = {
-        'X-Requested-With': 'XMLHttpRequest',
-        'Accept': 'application/json, text/javascript, */*; q=0.01',
-        'Referer': base_url + '/',
-        'User-Agent': user_agent
-    }
-
-    files = {
-        'file': ('blob', img, img_content_type)
-    }
-    try:
-        json_response = requests.post(upload_file_url, timeout=upload_timeout, files=files, headers=headers)
-    except requests.exceptions.ReadTimeout:
-        raise ImageUploadHTTPError('Request timeout')
+            if response.status_code == 304 and cached is not None:
+                cache.touch_url(source_url)
+                return _image_result(cached[0], return_json), None
+
+            if response.status_code != 200 or 'Content-Type' not in response.headers:
+                raise GetImageRequestError('Url request failed')
+
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            img_content_type = _get_mimetype_from_response_headers(response.headers)
+            if not _check_mimetypes(img_content_type):
+                raise FileTypeNotSupported('The "%s" filetype is not supported' % img_content_type)
+
+            length = response.headers.get('Content-Length', '')
+            if length.isdigit():
+                _check_size(int(length), max_size)
+            if length.isdigit() and hasher is None and not response.headers.get('Content-Encoding'):
+                # sent to telegra.ph as it's downloaded
+                img = _ImageStream(response.raw, int(length))
+            else:
+                img = _spool(response.iter_content(chunk_size), max_size, hasher, stack)
+
+        else:
+            img_content_type = mimetypes.guess_type(file_name_or_url)[0]
+            if not _check_mimetypes(img_content_type):
+                raise FileTypeNotSupported('The "%s" filetype is not supported' % img_content_type)
+            img = _file_stream(stack.enter_context(open(file_name_or_url, 'rb')), max_size, hasher, stack)
+
+        sha256 = None
+        if hasher is not None:
+            sha256 = hasher.hexdigest()
+            src = cache.get_file(sha256)
+            if src is not None:
+                cache.set(sha256, src, source_url, etag, last_modified)
+                return _image_result(src, return_json), None
+
+        size = img.len
+        img.throttle = throttle
+        m = MultipartEncoder({'file': ('blob', img, img_content_type)})
+        headers = {
+            'X-Requested-With': 'XMLHttpRequest',
+            'Accept': 'application/json, text/javascript, */*; q=0.01',
+            'Referer': base_url + '/',
+            'User-Agent': user_agent,
+            'Content-Type': m.content_type
+        }
+        try:
+            json_response = http.post(upload_url, timeout=upload_timeout, data=m, headers=headers)
+        except requests.exceptions.ReadTimeout:
+            raise ImageUploadHTTPError('Request timeout')
 
     if json_response.status_code == requests.codes.ok and json_response.content:
         json_response = json_response.json()
+        result = None
+        if type(json_response) is list and len(json_response) and 'src' in json_response[0] and sha256:
+            cache.set(sha256, json_response[0]['src'], source_url, etag, last_modified)
         if return_json:
-            return json_response
+            result = json_response
         elif type(json_response) is list and len(json_response):
-            return 'src' in json_response[0] and base_url + json_response[0]['src'] or ''
+            result = 'src' in json_response[0] and base_url + json_response[0]['src'] or ''
         elif type(json_response) is dict:
             if json_response.get('error') == 'File type invalid':
                 raise FileTypeNotSupported('This file is unsupported')
             else:
-                return str(json_response)
+                result = str(json_response)
+        return result, size
     else:
         raise Exception('Error while uploading the image')
+
+
+class _Bandwidth(object):
+    # shared limit of bytes per second, chunks of all uploads are sent one after another at this rate
+    def __init__(self, bytes_per_second):
+        self.rate = float(bytes_per_second)
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def __call__(self, size):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + size / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class ImageUploader(object):
+    """
+        Long-lived image upload service. Owns a thread pool and a keep-alive session, can be shared by many
+        DocumentPreprocessor objects and threads. Number of simultaneous uploads and upload bandwidth are limited
+        for all the work submitted to it.
+    """
+    def __init__(self, max_workers=8, max_bytes_per_second=None, cache=None, session=None,
+                 user_agent='Python_telegraph_poster/0.1', get_timeout=(10.0, 10.0), upload_timeout=(7.0, 7.0),
+                 upload_url=upload_file_url, max_size=max_image_size):
+        """
+        :param max_workers: max number of images downloaded and uploaded at once
+        :param max_bytes_per_second: limit of bytes sent to telegra.ph by all uploads, not limited if None
+        :param cache: ImageUploadCache used for all uploads
+        :param session: requests.Session for downloads and uploads. If not passed, the session is created
+            and closed in close()
+        """
+        self.max_workers = max_workers
+        self.cache = cache
+        self.user_agent = user_agent
+        self.get_timeout = get_timeout
+        self.upload_timeout = upload_timeout
+        self.upload_url = upload_url
+        self.max_size = max_size
+        self._throttle = _Bandwidth(max_bytes_per_second) if max_bytes_per_second else None
+        self._own_session = session is None
+        if session is None:
+            session = requests.Session()
+            # download of the image stays open while it's uploaded, so every worker needs two connections
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=2 * max_workers)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _upload(self, file_name_or_url, return_json=False):
+        return _upload_image(file_name_or_url, self.user_agent, return_json, self.get_timeout, self.upload_timeout,
+                             self.cache, self.upload_url, self.max_size, self.session, self._throttle)
+
+    def submit(self, file_name_or_url, return_json=False, with_size=False):
+        """
+            Schedules upload of the image, raises RuntimeError after close()
+        :param with_size: return (result, size) instead of result, size is the number of uploaded bytes
+            or None if the image was found in the cache
+        :return: concurrent.futures.Future with the result of upload_image()
+        """
+        if with_size:
+            return self._executor.submit(self._upload, file_name_or_url, return_json)
+        return self._executor.submit(lambda: self._upload(file_name_or_url, return_json)[0])
+
+    def upload(self, file_name_or_url, return_json=False, with_size=False):
+        """
+            Same as upload_image(), but waits for its turn in the pool
+        """
+        return self.submit(file_name_or_url, return_json, with_size).result()
+
+    def close(self):
+        """
+            Stops accepting new images, waits for submitted uploads and closes the session created by ImageUploader
+        """
+        self._executor.shutdown(wait=True)
+        if self._own_session:
+            self.session.close()
@@ -1,14 +1,32 @@
 # coding=utf8
 
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urljoin, urlsplit, urlunsplit
+from collections import OrderedDict, namedtuple
 import logging
-from .upload_images import upload_image
+import time
+from .upload_images import upload_image, upload_file_url, ImageUploader
 from .converter import _fragments_from_string
 import lxml.html
 import concurrent.futures
 
 LOG = logging.getLogger(__name__)
 
+ImageUploadResult = namedtuple('ImageUploadResult', ('url', 'new_url', 'status', 'size', 'seconds', 'elements', 'error'))
+
+default_ports = {'http': ':80', 'https': ':443'}
+
+
+def normalize_url(url):
+    """
+        Makes urls of the same resource equal: lowercase scheme and host, no default port and no fragment
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if netloc.endswith(default_ports.get(scheme, ' ')):
+        netloc = netloc[:-len(default_ports[scheme])]
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
 
 class DocumentPreprocessor:
     def __init__(self, input_document):
@@ -18,29 +36,74 @@ class DocumentPreprocessor:
     def get_processed_html(self):
         return lxml.html.tostring(self.parsed_document, encoding='unicode')
 
-    def upload_image(self, url):
-        new_image_url = None
+    def upload_image(self, url, image_cache=None, uploader=None):
+        """
+            Uploads one image
+        :param image_cache: ImageUploadCache with images uploaded earlier
+        :param uploader: shared ImageUploader, its cache is used instead of image_cache
+        :return: telegra.ph url of the image, or None if the upload failed
+        """
         try:
-            new_image_url = upload_image(url)
+            if uploader is None:
+                return upload_image(url, cache=image_cache)
+            return uploader.upload(url)
         except Exception:
             LOG.exception(f'Could not upload image {url}')
-
-        return new_image_url
-
-    def upload_all_images(self, base_url=None, max_workers=3):
+            return None
+
+    def upload_all_images(self, base_url=None, max_workers=3, image_cache=None, progress=None,
+                          upload_url=upload_file_url, uploader=None):
+        """
+            Uploads images of the document to telegra.ph and replaces their urls.
+            Every url is uploaded once, even if the document has several images with it.
+        :param base_url: base url for relative image urls
+        :param max_workers: number of images uploaded at once
+        :param image_cache: ImageUploadCache with images uploaded earlier
+        :param progress: function called with (result, done, total) after every url is processed
+        :param upload_url: telegra.ph upload endpoint
+        :param uploader: shared ImageUploader. Its pool, session, cache and limits are used instead of
+            max_workers, image_cache and upload_url
+        :return: list of ImageUploadResult(url, new_url, status, size, seconds, elements, error), one for every url
+            in document order. status is 'uploaded', 'cached' (image_cache had it) or 'failed'.
+            size is the number of uploaded bytes, seconds is the time from submitting the url until its result
+            was received, elements is the number of images with this url
+        """
         self._make_links_absolute(base_url)
         images = self.parsed_document.xpath('.//img[@src][not(contains(@src, "//telegra.ph/file/")) and'
                                             ' not(contains(@src, "//graph.org/file/"))]')
-
-        def _upload_and_replace_url(image_element):
-            old_image_url = image_element.attrib.get('src')
-            new_image_url = self.upload_image(old_image_url)
-            if new_image_url:
-                image_element.attrib.update({'src': new_image_url})
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            for image in images:
-                executor.submit(_upload_and_replace_url, image)
+        images_by_url = OrderedDict()
+        for image in images:
+            images_by_url.setdefault(normalize_url(image.attrib['src']), []).append(image)
+
+        own_uploader = uploader is None
+        if own_uploader:
+            uploader = ImageUploader(max_workers, cache=image_cache, upload_url=upload_url)
+        results = {}
+        try:
+            start = time.perf_counter()
+            futures = dict((uploader.submit(url, with_size=True), url) for url in images_by_url)
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                seconds = time.perf_counter() - start
+                url = futures[future]
+                try:
+                    new_url, size = future.result()
+                except Exception as e:
+                    LOG.exception(f'Could not upload image {url}')
+                    new_url, status, size, error = None, 'failed', 0, e
+                else:
+                    status, size, error = 'cached' if size is None else 'uploaded', size or 0, None
+                # the tree is changed only in this thread
+                if new_url:
+                    for image in images_by_url[url]:
+                        image.attrib['src'] = new_url
+                results[url] = ImageUploadResult(url, new_url, status, size, seconds,
+                                                 len(images_by_url[url]), error)
+                if progress is not None:
+                    progress(results[url], done, len(futures))
+        finally:
+            if own_uploader:
+                uploader.close()
+        return [results[url] for url in images_by_url]
 
     def _parse_document(self):
         if isinstance(self.input_document, str):
@@ -15,6 +15,7 @@ setup(name='html-telegraph-poster',
       license='MIT',
       packages=['html_telegraph_poster'],
       install_requires=['lxml', 'requests', 'requests_toolbelt'],
+      extras_require={'async': ['aiohttp']},
       classifiers=['Operating System :: OS Independent', 'Programming Language :: Python :: 3',
                    'License :: OSI Approved :: MIT License']
 )
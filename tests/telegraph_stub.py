@@ -0,0 +1,227 @@
+# coding=utf8
+import hashlib
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qsl
+from html_telegraph_poster import TelegraphPoster
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TelegraphStub(object):
+    """
+        Local server which implements a small part of telegra.ph api for tests
+    """
+    def __init__(self):
+        self.pages = {}
+        self.page_order = []
+        self.views = {}
+        # method -> list of errors returned by next calls
+        self.errors = {}
+        self.requests = []
+        # name -> (content type, bytes, etag) served at /images/name
+        self.images = {}
+        self.image_requests = []
+        self.image_downloads = []
+        # (size, sha256) of files uploaded to /upload
+        self.uploads = []
+        # if False, images are sent without Content-Length
+        self.send_image_length = True
+        self.connections = 0
+        # seconds to wait before answering, and max number of requests handled at once
+        self.delay = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super(Handler, self).setup()
+                with stub.lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                if self.path.startswith('/images/'):
+                    return self._send_image(self.path[len('/images/'):])
+                self._respond(dict(parse_qsl(urlparse(self.path).query)))
+
+            def do_POST(self):
+                if self.path == '/upload':
+                    uploaded_file = self._read_file()
+                    stub.start_request()
+                    body = json.dumps(stub.upload(uploaded_file)).encode('utf-8')
+                    stub.end_request()
+                    return self._send(200, body)
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self._respond(json.loads(body.decode('utf-8')) if body else {})
+
+            def _respond(self, params):
+                method = urlparse(self.path).path.strip('/')
+                stub.start_request()
+                body = json.dumps(stub.handle(method, params)).encode('utf-8')
+                stub.end_request()
+                self._send(200, body)
+
+            def _read_file(self):
+                # reads multipart body with one file in chunks, returns (size, sha256) of the file
+                length = int(self.headers['Content-Length'])
+                boundary = self.headers['Content-Type'].split('boundary=')[1].encode('ascii')
+                tail_size = len(b'\r\n--' + boundary + b'--\r\n')
+                head = b''
+                while not head.endswith(b'\r\n\r\n'):
+                    head += self.rfile.read(1)
+                left = size = length - len(head) - tail_size
+                hasher = hashlib.sha256()
+                while left:
+                    chunk = self.rfile.read(min(left, 65536))
+                    hasher.update(chunk)
+                    left -= len(chunk)
+                self.rfile.read(tail_size)
+                return size, hasher.hexdigest()
+
+            def _send_image(self, name):
+                with stub.lock:
+                    stub.image_requests.append(name)
+                if name not in stub.images:
+                    return self._send(404, b'')
+                content_type, content, etag = stub.images[name]
+                headers = {'ETag': etag} if etag else {}
+                if etag and self.headers.get('If-None-Match') == etag:
+                    return self._send(304, b'', headers=headers)
+                with stub.lock:
+                    stub.image_downloads.append(name)
+                self._send(200, content, content_type, headers, stub.send_image_length)
+
+            def _send(self, status, body, content_type='application/json', headers=None, send_length=True):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                if send_length:
+                    self.send_header('Content-Length', str(len(body)))
+                else:
+                    self.send_header('Connection', 'close')
+                    self.close_connection = True
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def start_request(self):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+
+    def end_request(self):
+        with self.lock:
+            self.active -= 1
+
+    def upload(self, uploaded_file):
+        with self.lock:
+            self.uploads.append(uploaded_file)
+            return [{'src': '/file/%d.png' % len(self.uploads)}]
+
+    def handle(self, method, params):
+        with self.lock:
+            self.requests.append((method, params))
+            if self.errors.get(method):
+                return {'ok': False, 'error': self.errors[method].pop(0)}
+            handler = getattr(self, 'api_' + method, None)
+            if handler is None:
+                return {'ok': False, 'error': 'UNKNOWN_METHOD'}
+            return handler(params)
+
+    def api_createAccount(self, params):
+        return {'ok': True, 'result': {
+            'short_name': params['short_name'],
+            'author_name': params.get('author_name', ''),
+            'author_url': params.get('author_url', ''),
+            'access_token': 'token%d' % len(self.requests),
+            'auth_url': 'https://edit.telegra.ph/auth/stub'
+        }}
+
+    def api_createPage(self, params):
+        path = '%s-%d' % (params['title'].replace(' ', '-'), len(self.page_order))
+        self.page_order.append(path)
+        return self.api_editPage(dict(params, path=path))
+
+    def api_editPage(self, params):
+        if params.get('path') not in self.pages and params.get('path') not in self.page_order:
+            return {'ok': False, 'error': 'PAGE_NOT_FOUND'}
+        page = {
+            'path': params['path'],
+            'url': self.url + '/' + params['path'],
+            'title': params['title'],
+            'description': '',
+            'author_name': params.get('author_name', ''),
+            'views': self.views.get(params['path'], 0),
+            'content': params['content'],
+        }
+        self.pages[params['path']] = page
+        return {'ok': True, 'result': dict((k, v) for k, v in page.items() if k != 'content')}
+
+    def api_getPage(self, params):
+        page = self.pages.get(params['path'].lstrip('/'))
+        if page is None:
+            return {'ok': False, 'error': 'PAGE_NOT_FOUND'}
+        if params.get('return_content') not in ('True', 'true', True):
+            page = dict((k, v) for k, v in page.items() if k != 'content')
+        return {'ok': True, 'result': dict(page)}
+
+    def api_getPageList(self, params):
+        offset, limit = int(params.get('offset', 0)), int(params.get('limit', 50))
+        paths = list(reversed(self.page_order))[offset:offset + limit]
+        pages = [dict((k, v) for k, v in self.pages[x].items() if k != 'content') for x in paths]
+        return {'ok': True, 'result': {'total_count': len(self.page_order), 'pages': pages}}
+
+    def api_getViews(self, params):
+        key = tuple([params['path']] + [params[x] for x in ('year', 'month', 'day', 'hour') if params.get(x)])
+        return {'ok': True, 'result': {'views': self.views.get(key, self.views.get(params['path'], 0))}}
+
+    def api_revokeAccessToken(self, params):
+        return {'ok': True, 'result': {'access_token': 'token%d' % len(self.requests)}}
+
+    def api_getAccountInfo(self, params):
+        return {'ok': True, 'result': {'short_name': 'Sandbox', 'page_count': len(self.page_order)}}
+
+
+class StubTestCase(unittest.TestCase):
+    """
+        Runs TelegraphStub during every test
+    """
+    def setUp(self):
+        self.stub = TelegraphStub()
+        self.stub.__enter__()
+        self.addCleanup(self.stub.__exit__)
+
+    def make_poster(self, **kwargs):
+        """
+            TelegraphPoster which sends requests to the stub, closed after the test
+        """
+        poster = TelegraphPoster(access_token='token', telegraph_api_url=self.stub.url, **kwargs)
+        self.addCleanup(poster.close)
+        return poster
@@ -0,0 +1,90 @@
+# coding=utf8
+import asyncio
+import unittest
+from telegraph_stub import StubTestCase
+try:
+    import aiohttp
+    from html_telegraph_poster.async_poster import AsyncTelegraphPoster
+except ImportError:
+    aiohttp = None
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncTelegraphPosterTest(StubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_post_edit_get_page(self):
+        async def run():
+            async with AsyncTelegraphPoster(access_token='token', telegraph_api_url=self.stub.url) as t:
+                await t.post('Title', 'author', '<p>first</p>')
+                await t.edit(text='<p>second <b>text</b></p>')
+                page = await t.get_page(t.path, return_content=True)
+                views = await t.get_views(t.path, year=2020)
+                page_list = await t.get_page_list()
+                return page, views, page_list
+
+        page, views, page_list = self.run_async(run())
+        self.assertEqual('<p>second <strong>text</strong></p>', page['html'])
+        self.assertEqual({'views': 0}, views)
+        self.assertEqual(1, page_list['total_count'])
+        self.assertEqual('true', self.stub.requests[2][1]['return_content'])
+        self.assertEqual(1, self.stub.connections)
+
+    def test_skip_unchanged(self):
+        async def run():
+            async with AsyncTelegraphPoster(access_token='token', telegraph_api_url=self.stub.url,
+                                            skip_unchanged=True) as t:
+                page = await t.post('Title', 'author', '<p>text</p>')
+                edited = await t.edit(text='<p>text</p>')
+                await t.edit(text='<p>new text</p>')
+                return page, edited, t.skipped_edits
+
+        page, edited, skipped = self.run_async(run())
+        self.assertEqual(page, edited)
+        self.assertEqual(1, skipped)
+        self.assertEqual(['createPage', 'editPage'], [x[0] for x in self.stub.requests])
+
+    def test_account_methods(self):
+        async def run():
+            async with AsyncTelegraphPoster(telegraph_api_url=self.stub.url) as t:
+                await t.create_account('Sandbox')
+                token = t.access_token
+                await t.revoke_access_token()
+                info = await t.get_account_info()
+                return token, t.access_token, info
+
+        token, new_token, info = self.run_async(run())
+        self.assertNotEqual(token, new_token)
+        self.assertEqual(new_token, self.stub.requests[-1][1]['access_token'])
+        self.assertEqual('Sandbox', info['short_name'])
+
+    def test_concurrent_posts_share_pool(self):
+        async def run():
+            async with AsyncTelegraphPoster(access_token='token', telegraph_api_url=self.stub.url, pool_size=4) as t:
+                return await asyncio.gather(*[
+                    t.create_page('Title %d' % i, 'author', '<p>%d</p>' % i) for i in range(100)
+                ])
+
+        results = self.run_async(run())
+        self.assertEqual(100, len(set(x['path'] for x in results)))
+        self.assertLessEqual(self.stub.connections, 4)
+
+    def test_api_error(self):
+        from html_telegraph_poster.errors import TelegraphError
+
+        async def run():
+            async with AsyncTelegraphPoster(access_token='token', telegraph_api_url=self.stub.url) as t:
+                await t.edit('Title', 'author', '<p>text</p>', path='missing')
+
+        self.assertRaises(TelegraphError, self.run_async, run())
+
+
+if __name__ == '__main__':
+    unittest.main()
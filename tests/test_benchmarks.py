@@ -0,0 +1,82 @@
+# coding=utf8
+import os
+import timeit
+import unittest
+from lxml import html
+from html_telegraph_poster.converter import replace_line_breaks_except_pre, join_following_elements
+from html_telegraph_poster.converter import convert_html_to_telegraph_format, _find_not_blank, max_content_size
+from html_telegraph_poster.html_to_telegraph import estimate_payload
+
+
+def best_time(func, *args):
+    return min(timeit.repeat(lambda: func(*args), number=1, repeat=5))
+
+
+@unittest.skipUnless(os.getenv('HTP_BENCHMARKS'), 'timing benchmarks run only with HTP_BENCHMARKS=1')
+class ConverterScalingBenchmark(unittest.TestCase):
+    # linear code grows by `growth` times, quadratic by growth ** 2
+    growth = 16
+
+    def assertLinear(self, small_time, large_time):
+        self.assertLess(large_time / small_time, self.growth * 4)
+
+    def test_replace_line_breaks_many_pre(self):
+        block = '<p>text\n    line</p>\n<pre>code<br>\n    line</pre>'
+        small = block * 250
+        large = block * 250 * self.growth
+        self.assertLinear(
+            best_time(replace_line_breaks_except_pre, small),
+            best_time(replace_line_breaks_except_pre, large)
+        )
+
+    def test_join_adjacent_pre(self):
+        def join(blocks):
+            document = html.fragment_fromstring('<div>%s</div>' % ('<pre>line of code</pre>\n' * blocks))
+            join_following_elements(document.xpath('.//pre'), join_string='\n')
+            self.assertEqual(1, len(document))
+
+        large = 10000
+        self.assertLinear(
+            best_time(join, large // self.growth),
+            best_time(join, large)
+        )
+
+    def test_many_images_inside_paragraph(self):
+        image = 'text <img src="http://telegra.ph/file/image.png"> '
+        self.assertLinear(
+            best_time(convert_html_to_telegraph_format, '<p>%s</p>' % (image * 250)),
+            best_time(convert_html_to_telegraph_format, '<p>%s</p>' % (image * 250 * self.growth))
+        )
+
+    def test_nested_inline_elements(self):
+        def nested(count):
+            return '<p>%s%s</p>' % (''.join('<em>%d ' % i for i in range(count)), '</em>' * count)
+
+        self.assertLinear(
+            best_time(convert_html_to_telegraph_format, nested(100)),
+            best_time(convert_html_to_telegraph_format, nested(100 * self.growth))
+        )
+
+    def test_small_list_in_big_document(self):
+        # only the list is walked to find empty list items, not the whole document
+        def find(paragraphs):
+            document = html.fragment_fromstring(
+                '<div>%s<ul><li>one</li><li> </li></ul></div>' % ('<p>text <b>bold</b></p>' * paragraphs)
+            )
+            lists = list(document.iter('ul', 'li'))
+            return min(timeit.repeat(lambda: _find_not_blank(lists), number=100, repeat=5))
+
+        self.assertLess(find(100 * self.growth) / find(100), 4)
+
+    def test_estimate_under_limit(self):
+        # html which is clearly smaller than the limit is not converted
+        document = '<p>Paragraph with <b>bold</b> and <a href="http://example.com/">link</a>.</p>' * 100
+        self.assertFalse(estimate_payload(document, max_size=max_content_size).exact)
+        self.assertLess(
+            best_time(lambda: estimate_payload(document, max_size=max_content_size)) * 20,
+            best_time(convert_html_to_telegraph_format, document)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# coding=utf8
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+from html_telegraph_poster.cache import ConversionCache, ImageUploadCache
+from html_telegraph_poster.converter import convert_html_to_telegraph_format
+from html_telegraph_poster.upload_images import upload_image
+from telegraph_stub import StubTestCase
+
+
+class ConversionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.html = '<p>cached <b>text</b></p>'
+
+    def test_hits_and_misses(self):
+        cache = ConversionCache()
+        first = cache.convert(self.html)
+        second = cache.convert(self.html)
+        self.assertEqual(convert_html_to_telegraph_format(self.html), first)
+        self.assertEqual(first, second)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        # different options are cached separately
+        cache.convert(self.html, clean_html=False)
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+    def test_python_list_is_copied(self):
+        cache = ConversionCache()
+        content = cache.convert(self.html, output_format='python_list')
+        content.append('modified')
+        self.assertEqual(
+            convert_html_to_telegraph_format(self.html, output_format='python_list'),
+            cache.convert(self.html, output_format='python_list')
+        )
+
+    def test_lru_eviction(self):
+        cache = ConversionCache(max_size=2)
+        cache.convert('<p>1</p>')
+        cache.convert('<p>2</p>')
+        cache.convert('<p>1</p>')
+        cache.convert('<p>3</p>')
+        self.assertEqual((1, 3), (cache.hits, cache.misses))
+        # <p>2</p> was least recently used
+        cache.convert('<p>2</p>')
+        cache.convert('<p>1</p>')
+        self.assertEqual((1, 5), (cache.hits, cache.misses))
+
+    def test_disk_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'conversions.sqlite')
+
+        cache = ConversionCache(path=path)
+        content = cache.convert(self.html)
+        cache.close()
+
+        cache = ConversionCache(max_size=1, path=path)
+        self.addCleanup(cache.close)
+        self.assertEqual(content, cache.convert(self.html))
+        self.assertEqual((1, 0), (cache.hits, cache.misses))
+
+
+class ImageUploadCacheTest(StubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = ImageUploadCache(':memory:')
+        self.addCleanup(self.cache.close)
+        self.stub.images['logo.png'] = ('image/png', b'logo', '"v1"')
+        self.stub.images['copy.png'] = ('image/png', b'logo', None)
+        self.stub.images['other.png'] = ('image/png', b'other', None)
+
+    def upload(self, name, **kwargs):
+        return upload_image(self.stub.url + '/images/' + name, cache=self.cache, upload_url=self.stub.url + '/upload',
+                            **kwargs)
+
+    def test_not_modified_url(self):
+        url = self.upload('logo.png')
+        self.assertEqual(url, self.upload('logo.png'))
+        self.assertEqual([{'src': '/file/1.png'}], self.upload('logo.png', return_json=True))
+        self.assertEqual(3, len(self.stub.image_requests))
+        self.assertEqual(['logo.png'], self.stub.image_downloads)
+        self.assertEqual(1, len(self.stub.uploads))
+
+    def test_modified_url(self):
+        self.upload('logo.png')
+        self.stub.images['logo.png'] = ('image/png', b'new logo', '"v2"')
+        self.assertEqual('http://telegra.ph/file/2.png', self.upload('logo.png'))
+        self.assertEqual(2, len(self.stub.image_downloads))
+        self.assertEqual(2, len(self.stub.uploads))
+
+    def test_same_content(self):
+        url = self.upload('logo.png')
+        self.assertEqual(url, self.upload('copy.png'))
+        with BytesIO(b'logo') as image:
+            image.name = 'image.png'
+            self.assertEqual(url, upload_image(image, cache=self.cache, upload_url=self.stub.url + '/upload'))
+        self.assertEqual(1, len(self.stub.uploads))
+        self.assertEqual((2, 1), (self.cache.hits, self.cache.misses))
+
+    def test_eviction(self):
+        self.cache.max_entries = 1
+        self.upload('logo.png')
+        self.upload('other.png')
+        self.upload('copy.png')
+        self.assertEqual(3, len(self.stub.uploads))
+
+        self.cache.max_age = 0
+        self.upload('other.png')
+        self.assertEqual(4, len(self.stub.uploads))
+
+    def test_disk_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'images.sqlite')
+        self.cache = ImageUploadCache(path)
+        url = self.upload('logo.png')
+        self.cache.close()
+
+        self.cache = ImageUploadCache(path)
+        self.addCleanup(self.cache.close)
+        self.assertEqual(url, self.upload('logo.png'))
+        self.assertEqual(['logo.png'], self.stub.image_downloads)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,12 @@
 import unittest
 from html_telegraph_poster.converter import convert_html_to_telegraph_format
 from html_telegraph_poster.converter import convert_json_to_html
+from html_telegraph_poster.converter import replace_line_breaks_except_pre
+from html_telegraph_poster.converter import clean_article_html
+from html_telegraph_poster.converter import write_telegraph_json, _convert_to_list, _create_element
+from html_telegraph_poster.converter import convert_many, split_telegraph_content
+from html_telegraph_poster.errors import TelegraphContentTooBigError
+from lxml.html.clean import Cleaner
 import json
 
 
@@ -250,6 +256,36 @@ class TelegraphConversionTest(JSONAssertion):
             [{'children': ['Blockquote text inside figure'], 'tag': 'blockquote'}],
             convert_html_to_telegraph_format(quote_inside_figure, clean_html=True))
 
+    def test_blockquote_inside_list(self):
+        html = '<ul><li>first<blockquote>quote</blockquote>after</li><li>second</li></ul>'
+        self.assertJson(
+            [{'tag': 'ul', 'children': [{'tag': 'li', 'children': ['first']}]},
+             {'tag': 'blockquote', 'children': ['quote']},
+             {'tag': 'ul', 'children': [{'tag': 'li', 'children': ['after']}, {'tag': 'li', 'children': ['second']}]}],
+            convert_html_to_telegraph_format(html, clean_html=True))
+
+    def test_blockquote_inside_em(self):
+        html = '<p>a <em>b <blockquote>quote</blockquote> c</em> d</p>'
+        self.assertJson(
+            [{'tag': 'p', 'children': ['a ', {'tag': 'em', 'children': ['b ']}]},
+             {'tag': 'blockquote', 'children': ['quote']},
+             {'tag': 'p', 'children': [{'tag': 'em', 'children': [' c']}, ' d']}],
+            convert_html_to_telegraph_format(html, clean_html=True))
+
+    def test_blockquote_inside_media_and_link(self):
+        # media and links are not split, so they are not duplicated
+        html = '<video src="/file/v.mp4">t<blockquote>quote</blockquote>u</video>'
+        self.assertJson(
+            [{'tag': 'blockquote', 'children': ['quote']},
+             {'tag': 'p', 'children': [{'tag': 'video', 'attrs': {'src': '/file/v.mp4'}, 'children': ['tu']}]}],
+            convert_html_to_telegraph_format(html, clean_html=True))
+        html = '<p><em>a <a href="/x">t<blockquote>quote</blockquote>u</a></em></p>'
+        self.assertJson(
+            [{'tag': 'blockquote', 'children': ['quote']},
+             {'tag': 'p', 'children': [{'tag': 'em', 'children': ['a ', {'tag': 'a', 'attrs': {'href': '/x'},
+                                                                          'children': ['tu']}]}]}],
+            convert_html_to_telegraph_format(html, clean_html=True))
+
     def test_bad_para(self):
         html = '<aside><p>text inside para</p><p>another para</p></aside>'
         # TODO: write html6 test
@@ -344,6 +380,41 @@ class TelegraphConversionTest(JSONAssertion):
             convert_html_to_telegraph_format(text, clean_html=False)
         )
 
+    def test_write_json(self):
+        from io import StringIO
+        html = '<p>first <em>para</em></p><figure><img src="/file/image.png"></figure><ul><li>"item"</li></ul>'
+        output = StringIO()
+        write_telegraph_json(html, output)
+        self.assertEqual(convert_html_to_telegraph_format(html), output.getvalue())
+        self.assertJson(convert_html_to_telegraph_format(html, output_format='python_list'), output.getvalue())
+
+    def test_split_content(self):
+        html = ''.join('<p>%d</p>' % i for i in range(30)) + '<!-- comment -->'
+        parts = split_telegraph_content(html, max_size=60)
+        self.assertEqual(convert_html_to_telegraph_format(html, output_format='python_list'), sum(parts, []))
+        self.assertEqual([2] * 5 + [1] * 20, [len(x) for x in parts])
+        for part in parts:
+            self.assertLessEqual(len(json.dumps(part, separators=(',', ':'))), 60)
+
+        self.assertEqual([[{'tag': 'p', 'children': [u'текст']}]], split_telegraph_content(u'<p>текст</p>', 39))
+        self.assertRaises(TelegraphContentTooBigError, split_telegraph_content, u'<p>текст</p>', 38)
+        self.assertEqual([[]], split_telegraph_content(''))
+
+    def test_deeply_nested_elements(self):
+        top = parent = _create_element('blockquote')
+        for _ in range(5000):
+            child = _create_element('blockquote')
+            child.tail = 'tail'
+            parent.append(child)
+            parent = child
+        parent.text = 'text'
+
+        content = _convert_to_list([top])
+        for _ in range(5000):
+            self.assertEqual('tail', content[0]['children'][-1])
+            content = content[0]['children']
+        self.assertEqual([{'tag': 'blockquote', 'children': ['text']}, 'tail'], content)
+
     def test_json_to_html(self):
 
         json_text = '[{"tag":"p","children":["First paragraph text (текст).\\nSecond string "]},' \
@@ -374,6 +445,14 @@ class TelegraphConversionTest(JSONAssertion):
 
         self.assertEqual(convert_json_to_html(json.loads(json_text)), html_text)
 
+    def test_json_to_html_escaping(self):
+        json_text = '[{"tag":"p","children":["a < b & c",{"tag":"br"},"  ",{"tag":"a","attrs":{"href":"/путь 1"},' \
+                    '"children":["link"]}]},{"tag":"ul","children":[{"tag":"li"},{"tag":"li","children":["item"]}]},' \
+                    '{"tag":"pre","children":["line",{"tag":"br"},"  line\\n"]},{"tag":"hr"}]'
+        html_text = '<p>a &lt; b &amp; c<br><br/><a href="http://telegra.ph/%D0%BF%D1%83%D1%82%D1%8C%201">link</a></p>' \
+                    '<ul><li><li>item</li></ul><pre>line\n  line\n</pre><hr>'
+        self.assertEqual(html_text, convert_json_to_html(json.loads(json_text)))
+
 
 class TelegraphConversionIframeTest(JSONAssertion):
     def setUp(self):
@@ -642,6 +721,20 @@ def test_divisible_by_6(input_value):<br>   assert input_value % 6 == 0
             convert_html_to_telegraph_format(html_br_inside_pre, clean_html=True)
         )
 
+    def test_clean_with_custom_cleaner(self):
+        cleaner = Cleaner(allow_tags=('p',), remove_unknown_tags=False)
+        self.assertEqual(
+            '<p>bold text</p>',
+            clean_article_html('<head><title>x</title></head><p><b>bold</b> text</p>', cleaner=cleaner)
+        )
+
+    def test_replace_line_breaks_except_pre(self):
+        html = '<p>a\n  b</p>  <pre>c<br>\n  d</pre><code>e\n</code>\n<pre>f</pre>g  \n'
+        self.assertEqual(
+            '<p>a b</p> <pre>c\n\n  d</pre><code>e\n</code> <pre>f</pre>g ',
+            replace_line_breaks_except_pre(html)
+        )
+
 
 class TelegraphConversionImagesTest(JSONAssertion):
     def setUp(self):
@@ -792,3 +885,26 @@ class TelegraphConversionTwitterLinksTest(JSONAssertion):
         <a name="no_href"></a></blockquote>
         '''
         self.assertJson(self.assert_with, convert_html_to_telegraph_format(duplicated_link_html, clean_html=True))
+
+
+class ConvertManyTest(unittest.TestCase):
+    def setUp(self):
+        self.documents = ['<p>document %d</p>' % x for x in range(20)]
+        self.documents[7] = None
+
+    def test_convert_many_ordered(self):
+        results = list(convert_many(self.documents, workers=2, chunksize=3))
+        self.assertEqual(list(range(20)), [x.index for x in results])
+        for document, result in zip(self.documents, results):
+            if document is None:
+                self.assertIsNone(result.content)
+                self.assertIsInstance(result.error, TypeError)
+            else:
+                self.assertIsNone(result.error)
+                self.assertEqual(convert_html_to_telegraph_format(document), result.content)
+
+    def test_convert_many_unordered(self):
+        results = convert_many(iter(self.documents), workers=2, chunksize=1, ordered=False, output_format='python_list')
+        results = sorted(results, key=lambda x: x.index)
+        self.assertEqual(list(range(20)), [x.index for x in results])
+        self.assertEqual([{'tag': 'p', 'children': ['document 19']}], results[19].content)
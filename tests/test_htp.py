@@ -1,8 +1,26 @@
 # coding=utf8
+import gc
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+import warnings
 from html_telegraph_poster.upload_images import upload_image, _get_mimetype_from_response_headers
-from html_telegraph_poster.upload_images import GetImageRequestError
+from html_telegraph_poster.upload_images import GetImageRequestError, ImageTooBigError, ImageUploader
 from html_telegraph_poster import TelegraphPoster
+from html_telegraph_poster.html_to_telegraph import create_session, estimate_payload, _prepare_api_upload
+from html_telegraph_poster.html_to_telegraph import _api_upload_params
+from html_telegraph_poster.converter import max_content_size
+from html_telegraph_poster.cache import ConversionCache, ImageUploadCache
+from html_telegraph_poster.errors import TitleRequiredError, TelegraphContentTooBigError, TelegraphError
+from html_telegraph_poster.utils import DocumentPreprocessor
+from telegraph_stub import StubTestCase
 
 
 class UploadImageTest(unittest.TestCase):
@@ -37,6 +55,124 @@ class UploadImageTest(unittest.TestCase):
         self.assertRaises(GetImageRequestError, _upload)
 
 
+class StreamingUploadTest(StubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.image = os.urandom(3 * 1024 * 1024)
+        self.stub.images['big.mp4'] = ('video/mp4', self.image, None)
+
+    def upload(self, file_name_or_url, **kwargs):
+        return upload_image(file_name_or_url, upload_url=self.stub.url + '/upload', **kwargs)
+
+    def assertUploaded(self, content):
+        self.assertEqual([(len(content), hashlib.sha256(content).hexdigest())], self.stub.uploads)
+
+    def test_url_is_streamed(self):
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        self.upload(self.stub.url + '/images/big.mp4')
+        self.assertLess(tracemalloc.get_traced_memory()[1], 1024 * 1024)
+        self.assertUploaded(self.image)
+
+    def test_url_without_length(self):
+        self.stub.send_image_length = False
+        self.upload(self.stub.url + '/images/big.mp4')
+        self.assertUploaded(self.image)
+
+    def test_max_size(self):
+        self.assertRaises(ImageTooBigError, self.upload, self.stub.url + '/images/big.mp4', max_size=1024 * 1024)
+        self.stub.send_image_length = False
+        self.assertRaises(ImageTooBigError, self.upload, self.stub.url + '/images/big.mp4', max_size=1024 * 1024)
+        self.assertEqual([], self.stub.uploads)
+
+    def test_local_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'video.mp4')
+        with open(path, 'wb') as f:
+            f.write(self.image)
+
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', ResourceWarning)
+            self.upload(path)
+            gc.collect()
+        self.assertLess(tracemalloc.get_traced_memory()[1], 1024 * 1024)
+        self.assertUploaded(self.image)
+        self.assertRaises(ImageTooBigError, self.upload, path, max_size=1024)
+
+    def test_file_object_position(self):
+        from io import BytesIO
+        with BytesIO(b'skipped' + self.image) as f:
+            f.name = 'video.mp4'
+            f.seek(len(b'skipped'))
+            self.upload(f)
+        self.assertUploaded(self.image)
+
+
+class ImageUploaderTest(StubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(6):
+            self.stub.images['%d.png' % i] = ('image/png', os.urandom(100 * 1024), None)
+
+    def uploader(self, **kwargs):
+        uploader = ImageUploader(upload_url=self.stub.url + '/upload', **kwargs)
+        self.addCleanup(uploader.close)
+        return uploader
+
+    def test_shared_by_documents(self):
+        self.stub.delay = 0.05
+        uploader = self.uploader(max_workers=2)
+        documents = [
+            DocumentPreprocessor(''.join('<img src="/images/%d.png"/>' % i for i in range(j, 6, 2)))
+            for j in range(2)
+        ]
+        threads = [
+            threading.Thread(target=x.upload_all_images, kwargs={'base_url': self.stub.url, 'uploader': uploader})
+            for x in documents
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(6, len(self.stub.uploads))
+        self.assertEqual(2, self.stub.max_active)
+        # keep-alive connections of the pool are reused
+        self.assertLessEqual(self.stub.connections, 4)
+        for document in documents:
+            self.assertEqual(3, len(document.parsed_document.xpath('.//img[starts-with(@src, "http://telegra.ph")]')))
+
+    def test_bandwidth(self):
+        uploader = self.uploader(max_workers=4, max_bytes_per_second=1024 * 1024)
+        start = time.monotonic()
+        futures = [uploader.submit(self.stub.url + '/images/%d.png' % i) for i in range(4)]
+        self.assertEqual(4, len(set(x.result() for x in futures)))
+        # first chunk is sent at once
+        self.assertGreaterEqual(time.monotonic() - start, (4 * 100 - 64) / 1024.0)
+
+    def test_close(self):
+        self.stub.delay = 0.05
+        uploader = self.uploader()
+        futures = [uploader.submit(self.stub.url + '/images/%d.png' % i) for i in range(3)]
+        uploader.close()
+        self.assertTrue(all(x.done() for x in futures))
+        self.assertEqual(3, len(self.stub.uploads))
+        self.assertRaises(RuntimeError, uploader.submit, self.stub.url + '/images/3.png')
+
+    def test_with_size(self):
+        cache = ImageUploadCache(':memory:')
+        self.addCleanup(cache.close)
+        uploader = self.uploader(cache=cache)
+        src, size = uploader.upload(self.stub.url + '/images/0.png', with_size=True)
+        self.assertEqual(100 * 1024, size)
+        self.assertEqual((src, None), uploader.submit(self.stub.url + '/images/0.png', with_size=True).result())
+
+
 class TelegraphPosterNoApiTest(unittest.TestCase):
     def test_post(self):
         t = TelegraphPoster(use_api=False)
@@ -142,5 +278,367 @@ class TelegraphPosterApiTest(unittest.TestCase):
         self.assertEqual(19, len(info['pages']))
 
 
+class TelegraphPosterSessionTest(StubTestCase):
+
+    def test_requests_share_connection(self):
+        with TelegraphPoster(access_token='token', telegraph_api_url=self.stub.url) as t:
+            t.post('Title', 'author', '<p>first</p>')
+            t.edit(text='<p>second</p>')
+            page = t.get_page(t.path, return_content=True)
+            t.get_views(t.path)
+            t.get_page_list()
+        self.assertEqual('<p>second</p>', page['html'])
+        self.assertEqual(5, len(self.stub.requests))
+        self.assertEqual(1, self.stub.connections)
+
+    def test_create_api_token(self):
+        with TelegraphPoster(use_api=True, telegraph_api_url=self.stub.url) as t:
+            t.create_api_token('Sandbox')
+            t.post('Title', 'author', '<p>text</p>')
+        self.assertEqual('createPage', self.stub.requests[1][0])
+        self.assertEqual(t.access_token, self.stub.requests[1][1]['access_token'])
+        self.assertEqual(1, self.stub.connections)
+
+    def test_external_session_is_not_closed(self):
+        session = create_session()
+        self.addCleanup(session.close)
+        with TelegraphPoster(access_token='token', telegraph_api_url=self.stub.url, session=session) as t:
+            t.post('Title', 'author', '<p>text</p>')
+        TelegraphPoster(access_token='token', telegraph_api_url=self.stub.url, session=session).get_page_list()
+        self.assertEqual(1, self.stub.connections)
+
+
+class IterPagesTest(StubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(450):
+            path = 'page-%d' % i
+            self.stub.page_order.append(path)
+            self.stub.pages[path] = {'path': path, 'title': 'page', 'content': []}
+        self.poster = self.make_poster()
+
+    def test_all_pages(self):
+        pages = list(self.poster.iter_pages())
+        self.assertEqual(['page-%d' % i for i in range(449, -1, -1)], [x['path'] for x in pages])
+        self.assertEqual([('0', '200'), ('200', '200'), ('400', '200')],
+                         [(x[1]['offset'], x[1]['limit']) for x in self.stub.requests])
+
+    def test_resume(self):
+        pages = self.poster.iter_pages(limit=100)
+        offset = 0
+        for offset, page in enumerate(pages):
+            if offset == 120:
+                break
+        pages.close()
+        self.assertEqual('page-329', page['path'])
+        resumed = list(self.poster.iter_pages(offset=offset, limit=100))
+        self.assertEqual(450 - 120, len(resumed))
+        self.assertEqual('page-329', resumed[0]['path'])
+
+    def test_prefetch(self):
+        self.stub.delay = 0.05
+        self.assertEqual(450, len(list(self.poster.iter_pages(limit=50, prefetch=3))))
+        self.assertEqual(3, self.stub.max_active)
+        self.assertEqual(9, len(self.stub.requests))
+
+    def test_no_prefetch(self):
+        pages = self.poster.iter_pages(limit=50, prefetch=0)
+        self.assertEqual(50, len(list(itertools.islice(pages, 50))))
+        self.assertEqual(1, len(self.stub.requests))
+        self.assertEqual(400, len(list(pages)))
+        self.assertEqual(9, len(self.stub.requests))
+        self.assertEqual(1, self.stub.max_active)
+        self.assertRaises(ValueError, list, self.poster.iter_pages(prefetch=-1))
+
+    def test_error(self):
+        self.stub.errors['getPageList'] = ['ACCESS_TOKEN_INVALID']
+        self.assertRaises(TelegraphError, list, self.poster.iter_pages())
+
+
+class GetViewsBulkTest(StubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.poster = self.make_poster()
+        self.paths = ['page-%d' % i for i in range(20)]
+        for i, path in enumerate(self.paths):
+            self.stub.views[path] = i * 10
+            self.stub.views[(path, '2020')] = i * 5
+            self.stub.views[(path, '2020', '12', '31', '23')] = i
+
+    def test_columns(self):
+        self.stub.delay = 0.02
+        buckets = [(), (2020,), (2020, 12, 31, 23)]
+        table = self.poster.get_views_bulk(self.paths, buckets, workers=4)
+        self.assertEqual([x for x in self.paths for _ in buckets], table.path)
+        self.assertEqual(buckets * 20, table.bucket)
+        self.assertEqual([x for i in range(20) for x in (i * 10, i * 5, i)], table.views)
+        self.assertEqual([], table.errors)
+        self.assertEqual(60, len(self.stub.requests))
+        self.assertEqual(4, self.stub.max_active)
+        self.assertEqual({'path': 'page-1', 'year': '2020', 'month': '12', 'day': '31', 'hour': '23',
+                          'access_token': 'token'},
+                         [x[1] for x in self.stub.requests if x[1]['path'] == 'page-1' and 'hour' in x[1]][0])
+
+    def test_errors(self):
+        self.stub.errors['getViews'] = ['PAGE_NOT_FOUND']
+        table = self.poster.get_views_bulk(self.paths[:3], workers=1)
+        self.assertEqual([None, 10, 20], table.views)
+        self.assertEqual([('page-0', ())], [x[:2] for x in table.errors])
+        self.assertIsInstance(table.errors[0][2], TelegraphError)
+
+    def test_refresh(self):
+        buckets = [(), (2020,), (2020, 12, 31, 23), (2999, 1)]
+        table = self.poster.get_views_bulk(self.paths[:2], buckets)
+        self.stub.errors['getViews'] = ['FLOOD_WAIT_1']
+        self.stub.requests = []
+        self.stub.views['page-1'] = 100
+        self.stub.views[('page-1', '2999', '1')] = 0
+        refreshed = self.poster.get_views_bulk(self.paths[:2], buckets, workers=1, previous=table)
+        # finished buckets are not requested again, failed one is
+        self.assertEqual([('page-0', ''), ('page-0', '2999'), ('page-1', ''), ('page-1', '2999')],
+                         sorted((x[1]['path'], x[1].get('year', '')) for x in self.stub.requests))
+        self.assertEqual([None, 0, 0, 0, 100, 5, 1, 0], refreshed.views)
+        again = self.poster.get_views_bulk(self.paths[:2], buckets, previous=refreshed)
+        self.assertEqual([0, 0, 0, 0, 100, 5, 1, 0], again.views)
+        self.assertEqual([], again.errors)
+
+    def test_invalid_bucket(self):
+        self.assertRaises(ValueError, self.poster.get_views_bulk, self.paths, [(2020, 1, 1, 1, 1)])
+        # day without month
+        self.assertRaises(ValueError, self.poster.get_views_bulk, self.paths, [(2020, None, 5)])
+        # trailing parts which are not set are omitted
+        table = self.poster.get_views_bulk(self.paths[:1], [(2020, None, None)])
+        self.assertEqual([(2020,)], table.bucket)
+
+
+class SkipUnchangedTest(StubTestCase):
+
+    def methods(self):
+        return [x[0] for x in self.stub.requests]
+
+    def test_unchanged_edits_are_skipped(self):
+        t = self.make_poster(skip_unchanged=True)
+        page = t.post('Title', 'author', '<p>text</p>')
+        self.assertEqual(page, t.edit())
+        self.assertEqual(page, t.edit(text='<p>text</p>', path=page['path']))
+        # same nodes from different html
+        self.assertEqual(page, t.edit(text='<p>text</p><p></p>'))
+        self.assertEqual(['createPage'], self.methods())
+        self.assertEqual(3, t.skipped_edits)
+
+        t.edit(title='New title')
+        t.edit(title='New title', author_url='https://a.b/')
+        t.edit(title='New title', author_url='https://a.b/', text='<p>new text</p>')
+        t.edit(title='New title', author_url='https://a.b/', text='<p>new text</p>')
+        self.assertEqual(['createPage', 'editPage', 'editPage', 'editPage'], self.methods())
+        self.assertEqual('New title', self.stub.pages[page['path']]['title'])
+        self.assertEqual(4, t.skipped_edits)
+
+    def test_failed_edit_is_not_remembered(self):
+        t = self.make_poster(skip_unchanged=True)
+        path = t.post('Title', 'author', '<p>text</p>')['path']
+        self.stub.errors['editPage'] = ['CONTENT_TOO_BIG']
+        self.assertRaises(TelegraphError, t.edit, text='<p>new text</p>')
+        t.edit(text='<p>new text</p>')
+        self.assertEqual(['createPage', 'editPage', 'editPage'], self.methods())
+        self.assertEqual([{'tag': 'p', 'children': ['new text']}], self.stub.pages[path]['content'])
+
+    def test_disabled_by_default(self):
+        t = self.make_poster()
+        t.post('Title', 'author', '<p>text</p>')
+        t.edit()
+        self.assertEqual(['createPage', 'editPage'], self.methods())
+        self.assertEqual({}, t.published)
+
+
+class PublishManyTest(StubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.poster = self.make_poster()
+
+    def test_ordered_results(self):
+        jobs = [('Title %d' % i, 'author', '<p>text %d</p>' % i) for i in range(30)]
+        jobs[7] = ('', 'author', '<p>no title</p>')
+        results = list(self.poster.publish_many(iter(jobs), workers=4))
+        self.assertEqual(list(range(30)), [x.index for x in results])
+        self.assertIsInstance(results[7].error, TitleRequiredError)
+        self.assertIsNone(results[7].page)
+        self.assertEqual('Title-3', results[3].page['path'].rsplit('-', 1)[0])
+        self.assertEqual(29, len(self.stub.pages))
+        self.assertIsNone(self.poster.path)
+
+    def test_pages_are_sent_concurrently(self):
+        self.stub.delay = 0.1
+        jobs = [('Title', 'author', '<p>text</p>', 'https://example.com/')] * 20
+        results = list(self.poster.publish_many(jobs, workers=5, ordered=False))
+        self.assertEqual(list(range(20)), sorted(x.index for x in results))
+        self.assertTrue(all(x.error is None for x in results))
+        self.assertEqual(5, self.stub.max_active)
+        self.assertEqual('https://example.com/', self.stub.requests[0][1]['author_url'])
+
+    def test_upload_images(self):
+        html = '<p>text</p><img src="http://telegra.ph/file/test.jpeg"/>'
+        result = next(self.poster.publish_many([('Title', 'author', html)], upload_images=True,
+                                                images_base_url='http://example.com/'))
+        self.assertIsNone(result.error)
+        self.assertEqual(
+            [{'tag': 'p', 'children': ['text']},
+             {'tag': 'figure', 'children': [{'tag': 'img', 'attrs': {'src': 'http://telegra.ph/file/test.jpeg'}}]}],
+            self.stub.pages[result.page['path']]['content']
+        )
+
+    def test_shared_uploader(self):
+        self.stub.images['a.png'] = ('image/png', b'a' * 100, None)
+        cache = ImageUploadCache(':memory:')
+        self.addCleanup(cache.close)
+        uploader = ImageUploader(cache=cache, upload_url=self.stub.url + '/upload')
+        self.addCleanup(uploader.close)
+        html = '<p>text {0}</p><img src="/images/a.png"/>'
+        jobs = [('Title', 'author', html.format(i)) for i in range(5)]
+        results = list(self.poster.publish_many(jobs, prepare_workers=1, upload_images=True,
+                                                images_base_url=self.stub.url, uploader=uploader))
+        self.assertTrue(all(x.error is None for x in results))
+        self.assertEqual(1, len(self.stub.uploads))
+        sources = set(self.stub.pages[x.page['path']]['content'][1]['children'][0]['attrs']['src'] for x in results)
+        self.assertEqual(1, len(sources))
+        # uploader passed by the caller is not closed
+        self.assertEqual(sources.pop(), uploader.upload(self.stub.url + '/images/a.png'))
+
+
+class PostPartsTest(StubTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.poster = self.make_poster()
+
+    def test_small_content(self):
+        pages = self.poster.post_parts('Title', 'author', '<p>text</p>')
+        self.assertEqual(1, len(pages))
+        self.assertEqual('Title', pages[0]['title'])
+        self.assertEqual([{'tag': 'p', 'children': ['text']}], self.stub.pages[pages[0]['path']]['content'])
+
+    def test_chained_parts(self):
+        paragraphs = ['<p>paragraph %d %s</p>' % (i, u'текст ' * 100) for i in range(150)]
+        pages = self.poster.post_parts('Title', 'author', ''.join(paragraphs), max_size=20000)
+        self.assertEqual(['Title (%d/%d)' % (i, len(pages)) for i in range(1, len(pages) + 1)],
+                         [x['title'] for x in pages])
+        self.assertGreater(len(pages), 5)
+
+        contents = [self.stub.pages[x['path']]['content'] for x in pages]
+        for content in contents:
+            self.assertLessEqual(len(json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')),
+                                 20000)
+
+        for i, content in enumerate(contents):
+            links = [x['children'][0] for x in content if isinstance(x['children'][0], dict)]
+            expected = []
+            if i > 0:
+                expected.append({'tag': 'a', 'attrs': {'href': pages[i - 1]['url']}, 'children': ['Previous part']})
+            if i < len(pages) - 1:
+                expected.append({'tag': 'a', 'attrs': {'href': pages[i + 1]['url']}, 'children': ['Next part']})
+            self.assertEqual(expected, links)
+
+        texts = [x['children'][0] for content in contents for x in content if isinstance(x['children'][0], str)]
+        self.assertEqual(150, len(texts))
+        self.assertTrue(texts[149].startswith('paragraph 149 '))
+
+    def test_too_big_node(self):
+        self.assertRaises(TelegraphContentTooBigError, self.poster.post_parts, 'Title', 'author',
+                          '<p>%s</p>' % ('a' * 70000))
+        self.assertEqual([], self.stub.requests)
+
+    def test_too_long_link_text(self):
+        self.assertRaises(ValueError, self.poster.post_parts, 'Title', 'author', '<p>text</p>',
+                          next_text='next ' * 200)
+        self.assertRaises(ValueError, self.poster.post_parts, 'Title', 'author', '<p>text</p>',
+                          previous_text=u'назад ' * 60)
+        self.assertEqual([], self.stub.requests)
+
+
+class ApiUploadBodyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.html = ''.join(u'<p>paragraph %d "<b>bold</b>" <a href="/x?a=%d&b">link</a> текст 😀</p>' % (i, i)
+                            for i in range(500))
+
+    def test_same_as_json_dumps(self):
+        for html in (self.html, '<p></p>', '<div><span title="t">text</span><!-- comment --> tail</div>'):
+            for path in (None, 'Title-01-01'):
+                for clean_html in (True, False):
+                    url, body, headers = _prepare_api_upload(u'Заголовок "q"', None, html, 'https://a.b/', 'token',
+                                                             clean_html=clean_html, path=path)
+                    params = _api_upload_params(u'Заголовок "q"', None, html, 'https://a.b/', 'token',
+                                                clean_html=clean_html, path=path)
+                    self.assertEqual(json.dumps(params, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                                     body)
+        cached = _prepare_api_upload('Title', 'author', self.html, access_token='token',
+                                     conversion_cache=ConversionCache())[1]
+        self.assertEqual(_prepare_api_upload('Title', 'author', self.html, access_token='token')[1], cached)
+
+    def test_memory(self):
+        def peak(build):
+            tracemalloc.start()
+            try:
+                build()
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        params = peak(lambda: json.dumps(_api_upload_params('Title', 'author', self.html, access_token='token'),
+                                         ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        body = peak(lambda: _prepare_api_upload('Title', 'author', self.html, access_token='token'))
+        # no list of nodes and no json string of the request
+        self.assertLess(body, params / 2)
+
+
+class EstimatePayloadTest(unittest.TestCase):
+
+    def assertExactSize(self, html, clean_html=True, path=None):
+        estimate = estimate_payload(html, u'Заголовок', 'author', 'https://a.b/', 'token', path, clean_html)
+        url, body, headers = _prepare_api_upload(u'Заголовок', 'author', html, 'https://a.b/', 'token',
+                                                 clean_html=clean_html, path=path)
+        self.assertEqual(len(body), estimate.size)
+        content = json.loads(body.decode('utf-8'))['content']
+        self.assertEqual(len(json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')),
+                         estimate.content_size)
+        return estimate
+
+    def test_size(self):
+        self.assertExactSize(u'<p>text "quoted" \\ \x01\t текст 😀</p><hr><ul><li>one</li><li></li></ul>')
+        self.assertExactSize('<p><a href="/path?a=1&b=2" target="_blank">link</a></p><img src="/i.png"/>',
+                             path='Title-01-01')
+        self.assertExactSize('<div><span title="t">text</span><!-- comment --> tail</div>', clean_html=False)
+
+    def test_nodes_and_rejected(self):
+        estimate = self.assertExactSize('<p>a<b>b<i>c</i></b></p><div><span title="t">text</span></div>',
+                                        clean_html=False)
+        self.assertEqual(9, estimate.node_count)
+        self.assertEqual(3, estimate.depth)
+        self.assertEqual({'div', 'span'}, estimate.rejected_tags)
+        self.assertEqual({'title'}, estimate.rejected_attributes)
+
+        estimate = estimate_payload('<div><span title="t">text</span></div>')
+        self.assertEqual((set(), set()), (estimate.rejected_tags, estimate.rejected_attributes))
+
+    def test_max_size(self):
+        html = '<p>text "quoted" <b>bold</b></p><img src="/i.png"/><iframe src="https://www.youtube.com/embed/x">'
+        exact = self.assertExactSize(html)
+        self.assertTrue(exact.exact)
+        bound = estimate_payload(html, u'Заголовок', 'author', 'https://a.b/', 'token', max_size=max_content_size)
+        self.assertFalse(bound.exact)
+        self.assertEqual((None, None, set(), set()),
+                         (bound.node_count, bound.depth, bound.rejected_tags, bound.rejected_attributes))
+        self.assertGreaterEqual(bound.content_size, exact.content_size)
+        self.assertEqual(bound.size - exact.size, bound.content_size - exact.content_size)
+
+        # near the limit, or without cleaning, html is converted
+        self.assertEqual(exact, estimate_payload(html, u'Заголовок', 'author', 'https://a.b/', 'token',
+                                                 max_size=exact.content_size))
+        self.assertTrue(estimate_payload(html, clean_html=False, max_size=max_content_size).exact)
+
+
 if __name__ == '__main__':
     unittest.main()
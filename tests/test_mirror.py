@@ -0,0 +1,84 @@
+# coding=utf8
+import os
+import shutil
+import tempfile
+import unittest
+from html_telegraph_poster.mirror import PageMirror
+from telegraph_stub import StubTestCase
+
+
+class PageMirrorTest(StubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.poster = self.make_poster()
+        self.paths = [self.poster.post('Page %d' % i, 'author', '<p>text %d</p>' % i)['path'] for i in range(5)]
+
+    def mirror(self, **kwargs):
+        mirror = PageMirror(self.poster, **kwargs)
+        self.addCleanup(mirror.close)
+        return mirror
+
+    def page_requests(self):
+        return sorted(x[1]['path'] for x in self.stub.requests if x[0] == 'getPage')
+
+    def test_sync(self):
+        mirror = self.mirror()
+        result = mirror.sync()
+        self.assertEqual(sorted(self.paths), sorted(result.new))
+        self.assertEqual(([], 0, [], []), (result.changed, result.unchanged, result.removed, result.errors))
+        self.assertEqual(sorted(self.paths), mirror.paths())
+        page = mirror.get(self.paths[2])
+        self.assertEqual('Page 2', page['title'])
+        self.assertEqual([{'tag': 'p', 'children': ['text 2']}], page['content'])
+        self.assertIsNone(mirror.get('missing'))
+
+        self.stub.requests = []
+        self.poster.edit('Page 2 edited', 'author', '<p>new text</p>', path=self.paths[2])
+        self.paths.append(self.poster.post('Page 5', 'author', '<p>text 5</p>')['path'])
+        self.stub.views[self.paths[0]] = 7
+        self.stub.pages[self.paths[0]]['views'] = 7
+        result = mirror.sync()
+        self.assertEqual(([self.paths[5]], [self.paths[2]], 4), result[:3])
+        self.assertEqual(sorted(self.paths[2::3]), self.page_requests())
+        self.assertEqual([{'tag': 'p', 'children': ['new text']}], mirror.get(self.paths[2])['content'])
+        self.assertEqual(7, mirror.get(self.paths[0])['views'])
+
+        self.stub.requests = []
+        self.assertEqual(([], [], 6, [], []), mirror.sync())
+        self.assertEqual([], self.page_requests())
+
+    def test_removed_and_errors(self):
+        mirror = self.mirror()
+        self.stub.errors['getPage'] = ['PAGE_NOT_FOUND']
+        result = mirror.sync()
+        self.assertEqual(4, len(result.new))
+        self.assertEqual(1, len(result.errors))
+        self.assertEqual(4, len(mirror))
+        # failed page is downloaded by the next sync
+        self.assertEqual([result.errors[0][0]], mirror.sync().new)
+
+        self.stub.page_order.remove(self.paths[1])
+        self.assertEqual([self.paths[1]], mirror.sync().removed)
+        self.assertEqual(4, len(mirror))
+
+    def test_max_age(self):
+        mirror = self.mirror(max_age=0)
+        mirror.sync()
+        self.stub.pages[self.paths[0]]['content'] = ['changed']
+        self.assertEqual(5, len(mirror.sync().changed))
+        self.assertEqual(['changed'], mirror.get(self.paths[0])['content'])
+
+    def test_database_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'mirror.sqlite')
+        with PageMirror(self.poster, path) as mirror:
+            mirror.sync()
+        self.stub.requests = []
+        result = self.mirror(path=path).sync()
+        self.assertEqual(5, result.unchanged)
+        self.assertEqual([], self.page_requests())
+
+
+if __name__ == '__main__':
+    unittest.main()
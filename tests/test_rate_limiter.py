@@ -0,0 +1,111 @@
+# coding=utf8
+import asyncio
+import threading
+import time
+import unittest
+from html_telegraph_poster import TelegraphPoster
+from html_telegraph_poster.errors import TelegraphError, TelegraphFloodWaitError
+from html_telegraph_poster.rate_limiter import RateLimiter
+from telegraph_stub import StubTestCase
+try:
+    from html_telegraph_poster.async_poster import AsyncTelegraphPoster
+except ImportError:
+    AsyncTelegraphPoster = None
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        limiter = RateLimiter(rate=50, burst=3)
+        start = time.monotonic()
+        waits = [limiter.acquire('token', 'createPage') for _ in range(8)]
+        self.assertEqual([0, 0, 0], waits[:3])
+        # 5 requests over the burst at 50 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        self.assertEqual(8, limiter.stats()['requests'])
+        self.assertEqual(0, limiter.stats()['queued'])
+
+    def test_buckets_are_separate(self):
+        limiter = RateLimiter(rate=1, burst=1)
+        self.assertEqual(0, limiter.acquire('token', 'createPage'))
+        self.assertEqual(0, limiter.acquire('token', 'getViews'))
+        self.assertEqual(0, limiter.acquire('other token', 'createPage'))
+
+    def test_threads_are_queued(self):
+        # the clock stands still and nobody stops waiting until all threads have their turn
+        can_go = threading.Event()
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            can_go.wait()
+
+        limiter = RateLimiter(rate=20, burst=1, clock=lambda: 100.0, sleep=sleep)
+        threads = [threading.Thread(target=limiter.acquire, args=('token', 'editPage')) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for _ in range(500):
+            if len(waits) == 5:
+                break
+            time.sleep(0.01)
+        can_go.set()
+        for thread in threads:
+            thread.join()
+        stats = limiter.stats()
+        self.assertEqual(5, stats['max_queued'])
+        self.assertEqual(0, stats['queued'])
+        self.assertEqual([0.05, 0.1, 0.15, 0.2, 0.25], [round(x, 6) for x in sorted(waits)])
+        self.assertAlmostEqual(0.25, stats['max_wait'])
+        self.assertAlmostEqual(0.75, stats['total_wait'])
+
+    def test_call_repeats_after_flood_wait(self):
+        limiter = RateLimiter(rate=100, burst=10, max_flood_retries=1)
+        errors = ['FLOOD_WAIT_1']
+
+        def request():
+            if errors:
+                raise TelegraphError(errors.pop())
+            return 'ok'
+
+        start = time.monotonic()
+        self.assertEqual('ok', limiter.call('token', 'createPage', request))
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+        self.assertEqual(1, limiter.stats()['flood_waits'])
+
+        errors.extend(['FLOOD_WAIT_0', 'FLOOD_WAIT_0'])
+        self.assertRaises(TelegraphFloodWaitError, limiter.call, 'token', 'createPage', request)
+
+
+class RateLimitedPosterTest(StubTestCase):
+
+    def test_post_after_flood_wait(self):
+        self.stub.errors['createPage'] = ['FLOOD_WAIT_1']
+        self.stub.errors['getViews'] = ['FLOOD_WAIT_1']
+        limiter = RateLimiter()
+        with TelegraphPoster(access_token='token', telegraph_api_url=self.stub.url, rate_limiter=limiter) as t:
+            result = t.post('Title', 'author', '<p>text</p>')
+            views = t.get_views(result['path'])
+        self.assertEqual({'views': 0}, views)
+        self.assertEqual(['createPage', 'createPage', 'getViews', 'getViews'], [x[0] for x in self.stub.requests])
+        self.assertEqual(2, limiter.stats()['flood_waits'])
+
+    @unittest.skipIf(AsyncTelegraphPoster is None, 'aiohttp is not installed')
+    def test_async_post_after_flood_wait(self):
+        self.stub.errors['createPage'] = ['FLOOD_WAIT_1']
+        limiter = RateLimiter(rate=100, burst=1)
+
+        async def run():
+            async with AsyncTelegraphPoster(access_token='token', telegraph_api_url=self.stub.url,
+                                            rate_limiter=limiter) as t:
+                return await asyncio.gather(*[t.create_page('Title', 'author', '<p>text</p>') for _ in range(5)])
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        results = loop.run_until_complete(run())
+        self.assertEqual(5, len(set(x['path'] for x in results)))
+        self.assertEqual(6, len(self.stub.requests))
+        self.assertEqual(1, limiter.stats()['flood_waits'])
+
+
+if __name__ == '__main__':
+    unittest.main()
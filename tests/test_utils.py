@@ -1,7 +1,10 @@
 # coding=utf8
 
 import unittest
+from html_telegraph_poster.cache import ImageUploadCache
+from html_telegraph_poster.upload_images import ImageUploader
 from html_telegraph_poster.utils import DocumentPreprocessor
+from telegraph_stub import StubTestCase
 
 
 class DocumentPreprocessorImageUploadTest(unittest.TestCase):
@@ -98,3 +101,52 @@ class DocumentPreprocessorImageUploadTest(unittest.TestCase):
 
     def test_pass_invalid_document_type(self):
         self.assertRaises(TypeError, DocumentPreprocessor, b'byte string')
+
+
+class UploadAllImagesTest(StubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stub.images['a.png'] = ('image/png', b'a' * 100, None)
+        self.stub.images['b.png'] = ('image/png', b'b' * 200, None)
+
+    def test_same_url_is_uploaded_once(self):
+        host = self.stub.url.replace('http://', 'HTTP://').upper()
+        dp = DocumentPreprocessor(
+            '<p><img src="{0}/images/a.png"/><img src="{1}/images/a.png#top"/><img src="/images/b.png"/>'
+            '<img src="{0}/images/missing.png"/><img src="{0}/images/a.png"/></p>'.format(self.stub.url, host)
+        )
+        progress = []
+        results = dp.upload_all_images(base_url=self.stub.url, upload_url=self.stub.url + '/upload',
+                                       progress=lambda result, done, total: progress.append((result.url, done, total)))
+
+        self.assertEqual(['a.png', 'b.png', 'missing.png'], sorted(self.stub.image_requests))
+        self.assertEqual([self.stub.url + '/images/' + x for x in ('a.png', 'b.png', 'missing.png')],
+                         [x.url for x in results])
+        self.assertEqual(['uploaded', 'uploaded', 'failed'], [x.status for x in results])
+        self.assertEqual([100, 200, 0], [x.size for x in results])
+        self.assertEqual([3, 1, 1], [x.elements for x in results])
+        self.assertIsNotNone(results[2].error)
+        self.assertEqual(['1', '2', '3'], sorted(str(x[1]) for x in progress))
+        self.assertEqual({3}, set(x[2] for x in progress))
+
+        sources = [x.attrib['src'] for x in dp.parsed_document.xpath('.//img')]
+        self.assertEqual([results[0].new_url] * 2 + [results[1].new_url, self.stub.url + '/images/missing.png',
+                                                     results[0].new_url], sources)
+
+    def test_cached(self):
+        cache = ImageUploadCache(':memory:')
+        self.addCleanup(cache.close)
+        html = '<p><img src="{0}/images/a.png"/></p>'.format(self.stub.url)
+        DocumentPreprocessor(html).upload_all_images(image_cache=cache, upload_url=self.stub.url + '/upload')
+        results = DocumentPreprocessor(html).upload_all_images(image_cache=cache,
+                                                               upload_url=self.stub.url + '/upload')
+        self.assertEqual('cached', results[0].status)
+        self.assertEqual(0, results[0].size)
+        self.assertEqual(1, len(self.stub.uploads))
+
+    def test_upload_image(self):
+        dp = DocumentPreprocessor('<p>text</p>')
+        with ImageUploader(upload_url=self.stub.url + '/upload') as uploader:
+            self.assertIn('/file/', dp.upload_image(self.stub.url + '/images/a.png', uploader=uploader))
+            self.assertIsNone(dp.upload_image(self.stub.url + '/images/missing.png', uploader=uploader))
+        self.assertEqual(1, len(self.stub.uploads))